@@ -14,6 +14,8 @@ import io
 from googleapiclient.discovery import build
 from googleapiclient.http import MediaFileUpload
 
+RESUMABLE_THRESHOLD = 5 * 1024 * 1024
+
 
 def resolve_service_account_key() -> str:
     env_key = os.environ.get("GOOGLE_APPLICATION_CREDENTIALS", "").strip()
@@ -63,8 +65,8 @@ def resolve_folder_id(drive):
 
     resp = drive.files().list(
         q="name = 'Recettes' and mimeType = 'application/vnd.google-apps.folder' and trashed = false",
-        fields="files(id, name)",
-        pageSize=10,
+        fields="files(id)",
+        pageSize=1,
         corpora="allDrives",
         includeItemsFromAllDrives=True,
         supportsAllDrives=True
@@ -77,11 +79,16 @@ def resolve_folder_id(drive):
     return folder_id
 
 
+SLASHES_RE = re.compile(r"[\\/]+")
+FORBIDDEN_CHARS_RE = re.compile(r"[:*?\"<>|]")
+WS_RE = re.compile(r"\s+")
+
+
 def sanitize_filename(title: str) -> str:
     name = title.strip()
-    name = re.sub(r"[\\/]+", "-", name)
-    name = re.sub(r"[:*?\"<>|]", "-", name)
-    name = re.sub(r"\s+", " ", name).strip()
+    name = SLASHES_RE.sub("-", name)
+    name = FORBIDDEN_CHARS_RE.sub("-", name)
+    name = WS_RE.sub(" ", name).strip()
     if not name.lower().endswith(".pdf"):
         name += ".pdf"
     return name
@@ -158,7 +165,7 @@ def main():
             key_path, scopes=scopes
         )
 
-    drive = build("drive", "v3", credentials=creds)
+    drive = build("drive", "v3", credentials=creds, cache_discovery=False)
 
     folder_id = resolve_folder_id(drive)
     if not folder_id:
@@ -178,7 +185,9 @@ def main():
         }))
         return 0
 
-    media = MediaFileUpload(str(pdf_path), mimetype="application/pdf", resumable=True)
+    # Small PDFs go up in a single multipart request; resumable sessions cost extra round-trips.
+    resumable = pdf_path.stat().st_size > RESUMABLE_THRESHOLD
+    media = MediaFileUpload(str(pdf_path), mimetype="application/pdf", resumable=resumable)
     file_meta = {
         "name": filename,
         "parents": [folder_id]
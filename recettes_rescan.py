@@ -24,14 +24,18 @@ import os
 import sys
 import io
 import csv
+import hashlib
 import json
+import multiprocessing
 import re
-import time
-import random
 import shutil
+import sqlite3
 import subprocess
 import tempfile
+import threading
 import unicodedata
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait
+from functools import lru_cache
 from pathlib import Path
 from typing import List, Dict, Optional, Tuple
 
@@ -44,6 +48,7 @@ _PDFMINER_NOISE_SUBSTRINGS = (
     "Could get FontBBox from font descriptor because",
     # keep room for other ultra-common pdfminer noise lines if needed later
 )
+_PDFMINER_NOISE_RE = re.compile("|".join(map(re.escape, _PDFMINER_NOISE_SUBSTRINGS)))
 
 class _StderrFilter:
     """
@@ -57,9 +62,8 @@ class _StderrFilter:
         if not msg:
             return
         # Drop only the exact noisy messages
-        for s in _PDFMINER_NOISE_SUBSTRINGS:
-            if s in msg:
-                return
+        if _PDFMINER_NOISE_RE.search(msg):
+            return
         self._underlying.write(msg)
 
     def flush(self):
@@ -72,10 +76,17 @@ class _StderrFilter:
 sys.stderr = _StderrFilter(sys.__stderr__)
 
 
+from google.auth.transport.requests import AuthorizedSession
 from google.oauth2 import service_account
 from googleapiclient.discovery import build
 from googleapiclient.http import MediaIoBaseDownload
-from googleapiclient.errors import HttpError
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:
+    import orjson  # optional: faster encoding of the index entries
+except ImportError:
+    orjson = None
 
 
 # ========== CONFIG ==========
@@ -96,52 +107,69 @@ OUT_JSON = BASE_DIR / "recettes_index.json"
 OUT_CSV = BASE_DIR / "recipes_list.csv"
 OUT_NUTR = BASE_DIR / "recipes_nutrition.csv"
 TMP_DIR = BASE_DIR / ".cache_recettes"
+TEXT_CACHE_DB = TMP_DIR / "text_cache.sqlite"   # extracted text per file id + modifiedTime
 NUTRION_CSV = BASE_DIR / "nutrition_table.csv"   # your custom table
 OCR_MIN_TEXT_CHARS = 80
 OCR_MAX_PAGES = 2
+DOWNLOAD_CHUNK_SIZE = 8 * 1024 * 1024   # MediaIoBaseDownload defaults to 100 KB per request
+RANGE_DOWNLOAD_MIN = 8 * 1024 * 1024    # above this, media is fetched as parallel byte ranges
+RANGE_PART_SIZE = 4 * 1024 * 1024
+RANGE_WORKERS = 4
+# googleapiclient retries 429/5xx/rate-limit 403s with exponential backoff itself.
+DRIVE_RETRIES = 5
+EXTRACT_WORKERS = int(os.environ.get("RECETTES_WORKERS", "8"))
+LIST_WORKERS = int(os.environ.get("RECETTES_LIST_WORKERS", "16"))
+LIST_BATCH_FOLDERS = 100  # one listing per folder; Drive accepts up to 100 calls per batch
+# pdfminer/python-docx are pure Python and hold the GIL: parse in processes.
+PARSE_PROCESSES = int(os.environ.get("RECETTES_PARSE_PROCESSES", str(os.cpu_count() or 1)))
 
 ENV_FOLDER_ID = os.environ.get("RECETTES_FOLDER_ID", "").strip()
 
 
 # ========== LOW-LEVEL HELPERS ==========
 
-def deaccent(s: str) -> str:
+NON_ALNUM_RE = re.compile(r"[^a-z0-9]+")
+ALPHA_RE = re.compile(r"[a-z]")
+WS_RE = re.compile(r"\s+")
+
+def _nfd_strip_marks(s: str) -> str:
     return ''.join(c for c in unicodedata.normalize('NFD', s) if unicodedata.category(c) != 'Mn')
 
+# Latin-1 + Latin Extended-A/B cover French text. Below U+0250 no character
+# decomposes into a reorderable non-mark, so per-character translation gives
+# the same result as normalizing the whole string.
+_DEACCENT_MAX = "\u024f"
+_DEACCENT_TABLE = {
+    cp: _nfd_strip_marks(chr(cp))
+    for cp in range(0x80, ord(_DEACCENT_MAX) + 1)
+    if _nfd_strip_marks(chr(cp)) != chr(cp)
+}
+
+def deaccent(s: str) -> str:
+    if s.isascii():
+        return s
+    if max(s) <= _DEACCENT_MAX:
+        return s.translate(_DEACCENT_TABLE)
+    return _nfd_strip_marks(s)
+
+@lru_cache(maxsize=16384)
 def normalize_title(s: str) -> str:
     # Lowercase + remove accents + keep alphanumerics/spaces.
     s = deaccent(s or "").lower()
-    s = re.sub(r"[^a-z0-9]+", " ", s).strip()
-    return re.sub(r"\s+", " ", s)
+    s = NON_ALNUM_RE.sub(" ", s).strip()
+    return WS_RE.sub(" ", s)
 
-_TITLE_STOP_WORDS = {
+_TITLE_STOP_WORDS = frozenset({
     "de", "du", "des", "la", "le", "les", "au", "aux", "a", "et", "en",
     "d", "l", "un", "une", "aux", "avec", "sans"
-}
+})
 
+@lru_cache(maxsize=16384)
 def title_key(s: str) -> str:
     base = normalize_title(s)
     if not base:
         return ""
-    tokens = [t for t in base.split(" ") if t and t not in _TITLE_STOP_WORDS]
-    tokens.sort()
-    return " ".join(tokens)
-
-def with_retries(fn, *args, **kwargs):
-    for attempt in range(5):
-        try:
-            return fn(*args, **kwargs)
-        except HttpError as e:
-            status = getattr(e, "resp", None).status if getattr(e, "resp", None) else None
-            if status in (403, 429, 500, 502, 503, 504):
-                # backoff
-                time.sleep((2 ** attempt) + random.random())
-                continue
-            raise
-        except Exception:
-            time.sleep((2 ** attempt) + random.random())
-    return fn(*args, **kwargs)
-
+    return " ".join(sorted(t for t in base.split(" ") if t and t not in _TITLE_STOP_WORDS))
 
 def find_service_account_file() -> Path:
     for cand in SERVICE_ACCOUNT_CANDIDATES:
@@ -159,24 +187,56 @@ def find_service_account_file() -> Path:
     sys.exit(1)
 
 
-def build_drive_service():
+def load_credentials():
     key_path = find_service_account_file()
-    creds = service_account.Credentials.from_service_account_file(
+    return service_account.Credentials.from_service_account_file(
         str(key_path), scopes=SCOPES
     )
-    return build("drive", "v3", credentials=creds)
+
+
+def build_drive_service(creds=None):
+    if creds is None:
+        creds = load_credentials()
+    # The discovery document ships with googleapiclient; skip the on-disk cache lookup.
+    return build("drive", "v3", credentials=creds, cache_discovery=False)
+
+
+_thread_local = threading.local()
+
+def thread_drive_service(creds):
+    # httplib2 (under googleapiclient) is not thread-safe: one service per worker thread.
+    service = getattr(_thread_local, "service", None)
+    if service is None:
+        service = build_drive_service(creds)
+        _thread_local.service = service
+    return service
+
+
+def thread_drive_session(creds):
+    # Plain authorized requests session for media downloads, one per worker thread.
+    session = getattr(_thread_local, "session", None)
+    if session is None:
+        session = AuthorizedSession(creds)
+        retry = Retry(
+            total=DRIVE_RETRIES,
+            backoff_factor=1,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=frozenset({"GET"}),
+        )
+        session.mount("https://", HTTPAdapter(max_retries=retry))
+        _thread_local.session = session
+    return session
 
 
 def get_or_save_folder_id(service, folder_name: str = "Recettes") -> str:
     # 1) ENV
     if ENV_FOLDER_ID:
         try:
-            meta = with_retries(
-                service.files().get,
+            meta = service.files().get(
                 fileId=ENV_FOLDER_ID,
                 fields="id,name,mimeType",
                 supportsAllDrives=True,
-            ).execute()
+            ).execute(num_retries=DRIVE_RETRIES)
             if meta.get("mimeType") == "application/vnd.google-apps.folder" and meta.get("name") == folder_name:
                 print(f"📂 Using RECETTES_FOLDER_ID from environment: {ENV_FOLDER_ID}")
                 return ENV_FOLDER_ID
@@ -191,12 +251,11 @@ def get_or_save_folder_id(service, folder_name: str = "Recettes") -> str:
         fid = ID_FILE.read_text(encoding="utf-8").strip()
         if fid:
             try:
-                meta = with_retries(
-                    service.files().get,
+                meta = service.files().get(
                     fileId=fid,
                     fields="id,name,mimeType",
                     supportsAllDrives=True,
-                ).execute()
+                ).execute(num_retries=DRIVE_RETRIES)
                 if meta.get("mimeType") == "application/vnd.google-apps.folder" and meta.get("name") == folder_name:
                     print(f"📂 Using cached folder ID from {ID_FILE}: {fid}")
                     return fid
@@ -206,16 +265,14 @@ def get_or_save_folder_id(service, folder_name: str = "Recettes") -> str:
 
     # 3) lookup by name
     print(f"🔍 Searching Drive for folder named '{folder_name}'...")
-    resp = with_retries(
-        service.files().list,
+    data = service.files().list(
         q=f"name = '{folder_name}' and mimeType = 'application/vnd.google-apps.folder' and trashed = false",
-        fields="files(id, name)",
-        pageSize=10,
+        fields="files(id)",
+        pageSize=1,
         supportsAllDrives=True,
         includeItemsFromAllDrives=True,
         corpora="allDrives",
-    )
-    data = resp.execute()
+    ).execute(num_retries=DRIVE_RETRIES)
     files = data.get("files", [])
     if not files:
         print(f"❌ Folder '{folder_name}' not found or not shared with the service account.")
@@ -227,37 +284,104 @@ def get_or_save_folder_id(service, folder_name: str = "Recettes") -> str:
     return folder_id
 
 
-def list_tree(service, folder_id: str) -> List[Dict]:
-    """Depth-first traversal of 'Recettes' folder tree with fullPath assembly."""
+FOLDER_MIME = "application/vnd.google-apps.folder"
+
+
+def _children_request(service, folder_id: str, page_token: Optional[str] = None):
+    return service.files().list(
+        q=f"'{folder_id}' in parents and trashed = false",
+        fields="nextPageToken, files(id, name, mimeType, createdTime, modifiedTime, size, md5Checksum)",
+        pageSize=1000,
+        pageToken=page_token,
+        supportsAllDrives=True,
+        includeItemsFromAllDrives=True,
+    )
+
+
+def _split_children(entries: List[Dict]) -> Tuple[List[Dict], List[Dict]]:
+    subs = [e for e in entries if e.get("mimeType") == FOLDER_MIME]
+    files = [e for e in entries if e.get("mimeType") != FOLDER_MIME]
+    return subs, files
+
+
+def list_children(service, folder_id: str, page_token: Optional[str] = None,
+                  entries: Optional[List[Dict]] = None) -> Tuple[List[Dict], List[Dict]]:
+    """Return (subfolders, files) directly under one folder, following pagination."""
+    entries = list(entries or [])
+    while True:
+        resp = _children_request(service, folder_id, page_token).execute(num_retries=DRIVE_RETRIES)
+        entries.extend(resp.get("files", []))
+        page_token = resp.get("nextPageToken")
+        if not page_token:
+            return _split_children(entries)
+
+
+def list_children_batch(service, folder_ids: List[str]) -> Dict[str, Tuple[List[Dict], List[Dict]]]:
+    """list_children for several folders in one batch HTTP round trip.
+
+    Sub-requests of a batch are not retried by googleapiclient, so any folder
+    whose listing failed is fetched again with the plain (retrying) call;
+    folders with more than one page continue from their nextPageToken.
+    """
+    found: Dict[str, Dict] = {}
+    failed = set()
+
+    def on_response(request_id, response, exception):
+        if exception is not None:
+            failed.add(request_id)
+        else:
+            found[request_id] = response
+
+    batch = service.new_batch_http_request(callback=on_response)
+    for fid in folder_ids:
+        batch.add(_children_request(service, fid), request_id=fid)
+    try:
+        batch.execute()
+    except Exception:
+        failed.update(folder_ids)
+
+    out: Dict[str, Tuple[List[Dict], List[Dict]]] = {}
+    for fid in folder_ids:
+        resp = found.get(fid)
+        if fid in failed or resp is None:
+            out[fid] = list_children(service, fid)
+        elif resp.get("nextPageToken"):
+            out[fid] = list_children(service, fid, resp["nextPageToken"], resp.get("files", []))
+        else:
+            out[fid] = _split_children(resp.get("files", []))
+    return out
+
+
+def list_tree(service, folder_id: str, creds=None) -> List[Dict]:
+    """Depth-first traversal of 'Recettes' folder tree with fullPath assembly.
+
+    With creds, each level of the tree is listed concurrently (one Drive service
+    per worker thread); the result keeps the depth-first order either way.
+    """
+    def fetch(chunk: List[str]) -> Dict[str, Tuple[List[Dict], List[Dict]]]:
+        return list_children_batch(service if creds is None else thread_drive_service(creds), chunk)
+
+    # Breadth-first: every folder of the current level is listed in parallel,
+    # LIST_BATCH_FOLDERS folders per batch request.
+    listings: Dict[str, Tuple[List[Dict], List[Dict]]] = {}
+    with ThreadPoolExecutor(max_workers=1 if creds is None else LIST_WORKERS) as pool:
+        frontier = [folder_id]
+        while frontier:
+            chunks = [frontier[i:i + LIST_BATCH_FOLDERS] for i in range(0, len(frontier), LIST_BATCH_FOLDERS)]
+            for listing in pool.map(fetch, chunks):
+                listings.update(listing)
+            frontier = list(dict.fromkeys(
+                sf["id"] for fid in frontier for sf in listings[fid][0] if sf["id"] not in listings
+            ))
+
     items: List[Dict] = []
     stack = [(folder_id, [])]  # (id, path_segments)
 
     while stack:
         cur_id, cur_path = stack.pop()
-
-        # subfolders
-        res_sub = with_retries(
-            service.files().list,
-            q=f"'{cur_id}' in parents and mimeType = 'application/vnd.google-apps.folder' and trashed = false",
-            fields="files(id, name)",
-            pageSize=1000,
-            supportsAllDrives=True,
-            includeItemsFromAllDrives=True,
-        )
-        subs = res_sub.execute().get("files", [])
+        subs, files = listings[cur_id]
         for sf in subs:
             stack.append((sf["id"], cur_path + [sf["name"]]))
-
-        # files
-        res_files = with_retries(
-            service.files().list,
-            q=f"'{cur_id}' in parents and mimeType != 'application/vnd.google-apps.folder' and trashed = false",
-            fields="files(id, name, mimeType, createdTime, modifiedTime)",
-            pageSize=1000,
-            supportsAllDrives=True,
-            includeItemsFromAllDrives=True,
-        )
-        files = res_files.execute().get("files", [])
         for f in files:
             items.append(
                 {
@@ -272,19 +396,94 @@ def list_tree(service, folder_id: str) -> List[Dict]:
 # ========== TEXT EXTRACTION ==========
 
 def export_google_doc_text(service, file_id: str) -> str:
-    data = with_retries(
-        service.files().export(fileId=file_id, mimeType="text/plain").execute
-    )
-    return data.decode("utf-8", errors="ignore")
-
-
-def download_file(service, file_id: str, filename: Path):
-    request = service.files().get_media(fileId=file_id, supportsAllDrives=True)
-    fh = io.FileIO(str(filename), "wb")
-    downloader = MediaIoBaseDownload(fh, request)
+    request = service.files().export_media(fileId=file_id, mimeType="text/plain")
+    buf = io.BytesIO()
+    downloader = MediaIoBaseDownload(buf, request, chunksize=DOWNLOAD_CHUNK_SIZE)
     done = False
     while not done:
-        status, done = with_retries(downloader.next_chunk)
+        status, done = downloader.next_chunk(num_retries=DRIVE_RETRIES)
+    return buf.getvalue().decode("utf-8", errors="ignore")
+
+
+def _media_url(file_id: str) -> str:
+    return f"https://www.googleapis.com/drive/v3/files/{file_id}?alt=media&supportsAllDrives=true"
+
+
+def download_file(creds, file_id: str, filename: Path, size: int = 0):
+    # Download next to the target and rename on success: a failed or partial
+    # download never leaves a file at `filename` that looks complete.
+    part = filename.with_name(filename.name + ".part")
+    try:
+        if size > RANGE_DOWNLOAD_MIN:
+            download_file_ranges(creds, file_id, part, size)
+        else:
+            # One streamed GET instead of a ranged request per MediaIoBaseDownload chunk.
+            session = thread_drive_session(creds)
+            with session.get(_media_url(file_id), stream=True) as resp:
+                resp.raise_for_status()
+                with open(part, "wb") as fh:
+                    for chunk in resp.iter_content(chunk_size=1024 * 1024):
+                        fh.write(chunk)
+    except BaseException:
+        part.unlink(missing_ok=True)
+        raise
+    os.replace(part, filename)
+
+
+# Shared by all downloads and never shut down, so each range thread keeps its
+# Drive session (and its connections) across files. Threads start on first use.
+RANGE_POOL = ThreadPoolExecutor(max_workers=RANGE_WORKERS, thread_name_prefix="range")
+
+
+def download_file_ranges(creds, file_id: str, filename: Path, size: int):
+    """Fetch a large file as parallel byte ranges written in place with os.pwrite."""
+    starts = range(0, size, RANGE_PART_SIZE)
+
+    def fetch(start: int):
+        end = min(start + RANGE_PART_SIZE, size) - 1
+        resp = thread_drive_session(creds).get(_media_url(file_id), headers={"Range": f"bytes={start}-{end}"})
+        resp.raise_for_status()
+        if resp.status_code != 206 or len(resp.content) != end - start + 1:
+            raise RuntimeError(f"range {start}-{end} not honoured for {file_id}")
+        os.pwrite(fd, resp.content, start)
+
+    fd = os.open(filename, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        os.ftruncate(fd, size)
+        futures = [RANGE_POOL.submit(fetch, start) for start in starts]
+        try:
+            for fut in futures:
+                fut.result()
+        finally:
+            # No range may still be writing to fd once it is closed.
+            for fut in futures:
+                fut.cancel()
+            wait(futures)
+    finally:
+        os.close(fd)
+
+
+def _download_meta(item: Dict) -> Dict[str, str]:
+    return {k: item.get(k, "") for k in ("modifiedTime", "size", "md5Checksum")}
+
+
+def file_md5(path: Path) -> str:
+    h = hashlib.md5()
+    with open(path, "rb") as fh:
+        for chunk in iter(lambda: fh.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def download_is_current(local_path: Path, item: Dict) -> bool:
+    """True when local_path already holds this revision of the Drive file."""
+    if not item.get("md5Checksum") or not local_path.exists():
+        return False
+    try:
+        meta = json.loads((TMP_DIR / f"{item['id']}.meta.json").read_text(encoding="utf-8"))
+    except Exception:
+        return False
+    return meta == _download_meta(item) and str(local_path.stat().st_size) == item.get("size")
 
 
 def extract_text_from_pdf(local_path: Path) -> str:
@@ -303,16 +502,24 @@ def extract_text_from_pdf(local_path: Path) -> str:
     return ocr_text or text
 
 
+OCR_KEYWORDS_RE = re.compile(r"ingr|ingredient|etape|prepar|cuisson|instructions")
+
 def should_ocr_text(text: str) -> bool:
     stripped = (text or "").strip()
     if len(stripped) < OCR_MIN_TEXT_CHARS:
         return True
     lowered = deaccent(stripped.lower())
-    if re.search(r"ingr|ingredient|etape|prepar|cuisson|instructions", lowered):
+    if OCR_KEYWORDS_RE.search(lowered):
         return False
     return True
 
 
+def ocr_page_text(img: Path) -> str:
+    t_cmd = [ocr_tool("tesseract"), str(img), "stdout", "-l", "fra+eng"]
+    proc = subprocess.run(t_cmd, check=False, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    return proc.stdout.decode("utf-8", errors="ignore") if proc.stdout else ""
+
+
 def ocr_pdf_text(local_path: Path) -> str:
     if not can_ocr_pdf():
         return ""
@@ -320,7 +527,7 @@ def ocr_pdf_text(local_path: Path) -> str:
     try:
         output_prefix = tmp_dir / "page"
         cmd = [
-            "pdftoppm",
+            ocr_tool("pdftoppm"),
             "-r", "200",
             "-f", "1",
             "-l", str(OCR_MAX_PAGES),
@@ -329,13 +536,13 @@ def ocr_pdf_text(local_path: Path) -> str:
             str(output_prefix)
         ]
         subprocess.run(cmd, check=False, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        texts = []
-        for img in sorted(tmp_dir.glob("page-*.png")):
-            t_cmd = ["tesseract", str(img), "stdout", "-l", "fra+eng"]
-            proc = subprocess.run(t_cmd, check=False, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            if proc.stdout:
-                texts.append(proc.stdout.decode("utf-8", errors="ignore"))
-        return "\n".join(texts).strip()
+        pages = sorted(tmp_dir.glob("page-*.png"))
+        if not pages:
+            return ""
+        # tesseract is single-threaded per call: OCR the pages side by side.
+        with ThreadPoolExecutor(max_workers=min(len(pages), os.cpu_count() or 1)) as pool:
+            outputs = list(pool.map(ocr_page_text, pages))
+        return "\n".join(t for t in outputs if t).strip()
     finally:
         try:
             shutil.rmtree(tmp_dir)
@@ -343,10 +550,16 @@ def ocr_pdf_text(local_path: Path) -> str:
             pass
 
 
+@lru_cache(maxsize=None)
+def ocr_tool(name: str) -> Optional[str]:
+    # Resolved once per process: absolute path of pdftoppm/tesseract, or None.
+    return shutil.which(name)
+
+
 def can_ocr_pdf() -> bool:
-    if not shutil.which("pdftoppm"):
+    if not ocr_tool("pdftoppm"):
         return False
-    if not shutil.which("tesseract"):
+    if not ocr_tool("tesseract"):
         return False
     return True
 
@@ -365,16 +578,22 @@ def extract_text_from_docx(local_path: Path) -> str:
 
 
 def extract_text_from_plain(local_path: Path) -> str:
+    # Read once and try each encoding on the same bytes instead of reopening.
+    try:
+        raw = local_path.read_bytes()
+    except OSError:
+        return ""
     for enc in ("utf-8", "latin-1", "cp1252"):
         try:
-            with open(local_path, "r", encoding=enc) as f:
-                return f.read()
-        except Exception:
+            text = raw.decode(enc)
+        except UnicodeDecodeError:
             continue
+        # Same newline handling as text-mode open().
+        return text.replace("\r\n", "\n").replace("\r", "\n")
     return ""
 
 
-def extract_recipe_text(service, item: Dict) -> str:
+def extract_recipe_text(creds, item: Dict, parse_pool: Optional[ProcessPoolExecutor] = None) -> str:
     TMP_DIR.mkdir(exist_ok=True)
     fid = item["id"]
     name = item["name"]
@@ -382,7 +601,7 @@ def extract_recipe_text(service, item: Dict) -> str:
 
     # Google Docs
     if mt == "application/vnd.google-apps.document":
-        return export_google_doc_text(service, fid)
+        return export_google_doc_text(thread_drive_service(creds), fid)
 
     # Ignore other Google internal types
     if mt.startswith("application/vnd.google-apps."):
@@ -390,18 +609,89 @@ def extract_recipe_text(service, item: Dict) -> str:
 
     ext = name.lower().rsplit(".", 1)[-1] if "." in name else ""
     local_path = TMP_DIR / f"{fid}.{ext or 'bin'}"
-    download_file(service, fid, local_path)
-
-    if ext == "pdf":
-        return extract_text_from_pdf(local_path)
-    if ext == "docx":
-        return extract_text_from_docx(local_path)
+    if not download_is_current(local_path, item):
+        download_file(creds, fid, local_path, int(item.get("size") or 0))
+        # Hash once here, so the sidecar only ever vouches for verified bytes.
+        if item.get("md5Checksum") and file_md5(local_path) != item["md5Checksum"]:
+            local_path.unlink(missing_ok=True)
+            raise RuntimeError(f"md5 mismatch for {name} ({fid})")
+        (TMP_DIR / f"{fid}.meta.json").write_text(json.dumps(_download_meta(item)), encoding="utf-8")
+
+    if ext in ("pdf", "docx"):
+        parse = extract_text_from_pdf if ext == "pdf" else extract_text_from_docx
+        if parse_pool is None:
+            return parse(local_path)
+        return parse_pool.submit(parse, local_path).result()
     if ext in ("txt", "md"):
         return extract_text_from_plain(local_path)
     # fallback: try plain
     return extract_text_from_plain(local_path)
 
 
+class TextCache:
+    """sqlite store of extracted text keyed by file id, modifiedTime and OCR availability.
+
+    One connection is shared by the worker threads; a lock serializes access.
+    Rows are written as files are extracted, so an interrupted run keeps its work.
+    """
+
+    def __init__(self, path: Path):
+        path.parent.mkdir(exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(path), check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS text_cache ("
+            "file_id TEXT PRIMARY KEY, modified TEXT NOT NULL, ocr INTEGER NOT NULL, text TEXT NOT NULL)"
+        )
+
+    def get(self, file_id: str, modified: str, ocr: bool) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT text FROM text_cache WHERE file_id = ? AND modified = ? AND ocr = ?",
+                (file_id, modified, int(ocr)),
+            ).fetchone()
+        return row[0] if row else None
+
+    def put(self, file_id: str, modified: str, ocr: bool, text: str) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO text_cache (file_id, modified, ocr, text) VALUES (?, ?, ?, ?)",
+                (file_id, modified, int(ocr), text),
+            )
+
+    def prune(self, keep_ids) -> None:
+        # Drop files that disappeared from Drive so the cache does not grow forever.
+        keep = set(keep_ids)
+        with self._lock:
+            stale = [(fid,) for (fid,) in self._conn.execute("SELECT file_id FROM text_cache") if fid not in keep]
+            self._conn.executemany("DELETE FROM text_cache WHERE file_id = ?", stale)
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def cached_recipe_text(creds, item: Dict, cache: TextCache,
+                       parse_pool: Optional[ProcessPoolExecutor] = None) -> str:
+    """extract_recipe_text, skipped when the file is unchanged since the last run.
+
+    Entries are keyed on Drive's modifiedTime and on whether OCR was available,
+    so installing pdftoppm/tesseract re-extracts scanned PDFs.
+    """
+    modified = item.get("modifiedTime", "")
+    ocr = can_ocr_pdf()
+    if modified:
+        hit = cache.get(item["id"], modified, ocr)
+        if hit is not None:
+            return hit
+    text = extract_recipe_text(creds, item, parse_pool)
+    if text and modified:
+        cache.put(item["id"], modified, ocr, text)
+    return text
+
+
 # ========== PARSING RECETTES ==========
 
 INGR_HEADERS = [
@@ -435,6 +725,10 @@ STEP_HEADERS = [
     r"p\s*r\s*[ée]?\s*p\s*a\s*r\s*a\s*t\s*i\s*o\s*n"
 ]
 
+# One alternation per header family: a single regex call per line instead of one per pattern.
+INGR_HEADER_RE = re.compile("|".join(f"(?:{p})" for p in INGR_HEADERS), re.I)
+STEP_HEADER_RE = re.compile("|".join(f"(?:{p})" for p in STEP_HEADERS), re.I)
+
 FRACTIONS_MAP = {
     "¼": "1/4",
     "½": "1/2",
@@ -446,6 +740,8 @@ FRACTIONS_MAP = {
     "⅝": "5/8",
     "⅞": "7/8",
 }
+# Unicode fractions and long dashes, rewritten in one str.translate pass.
+QTY_CHAR_TRANS = str.maketrans({**FRACTIONS_MAP, "–": "-", "—": "-"})
 
 # Strict ingredient line: quantity required, unit optional, item required.
 ING_LINE_RE = re.compile(
@@ -493,30 +789,50 @@ SKIP_INGR_SIMPLE_RE = re.compile(
     re.I,
 )
 
+# Both skip filters in one pass (every alternative is anchored at the start).
+SKIP_INGR_RE = re.compile(
+    f"(?:{SKIP_INGR_LINE_RE.pattern})|(?:{SKIP_INGR_SIMPLE_RE.pattern})",
+    re.I,
+)
+
 
 STEP_MARK_RE = re.compile(r"^\s*(\d+[\)\.]|\d+\s+|[ée]tape|step)\b", re.I)
 
+LIST_MARK_RE = re.compile(r"^[\-•*\+\d.\)\s]+")
+BULLET_RE = re.compile(r"^[\-•*+]+\s*")
+DIGIT_RE = re.compile(r"\d")
+TIMES_RE = re.compile(r"(\d)\s*[xX]\s*(\d)")
+FRACTION_SPLIT_RE = re.compile(r"(\d)([¼½¾⅓⅔⅛⅜⅝⅞])")
+QTY_PAREN_RE = re.compile(r"^\s*(\d+)\s*\(([^)]+)\)\s*(.+)$")
+
 
 def split_sections(text: str) -> Dict[str, str]:
     lines = [l.strip() for l in text.splitlines()]
     if not lines:
         return {"ingredients": "", "steps": "", "status": "INCOMPLETE", "notes": ["empty_text"]}
 
-    def find_header(patterns: List[str], start: int = 0) -> Optional[int]:
-        for i in range(start, len(lines)):
-            for p in patterns:
-                if re.search(p, lines[i], re.I):
-                    return i
-        return None
-
     def find_first_step_marker(block_lines: List[str]) -> Optional[int]:
         for i, line in enumerate(block_lines):
             if STEP_MARK_RE.search(line):
                 return i
         return None
 
-    i_ing = find_header(INGR_HEADERS, 0)
-    i_step = find_header(STEP_HEADERS, (i_ing + 1) if i_ing is not None else 0)
+    # Single pass: first ingredients header, then the first steps header after it
+    # (or the first steps header anywhere when there is no ingredients header).
+    i_ing: Optional[int] = None
+    i_step: Optional[int] = None
+    first_step: Optional[int] = None
+    for i, line in enumerate(lines):
+        if i_ing is None:
+            if INGR_HEADER_RE.search(line):
+                i_ing = i
+            elif first_step is None and STEP_HEADER_RE.search(line):
+                first_step = i
+        elif STEP_HEADER_RE.search(line):
+            i_step = i
+            break
+    if i_ing is None:
+        i_step = first_step
 
     notes = []
     if i_ing is None:
@@ -529,11 +845,12 @@ def split_sections(text: str) -> Dict[str, str]:
         steps_txt = "\n".join(lines[i_step + 1 :]).strip()
         notes.append("ingredients_fallback_before_steps")
     elif i_ing is not None and i_step is None:
-        ingredients_txt = "\n".join(lines[i_ing + 1 :]).strip()
+        block = lines[i_ing + 1 :]
         steps_txt = ""
-        idx = find_first_step_marker(lines[i_ing + 1 :])
-        if idx is not None:
-            block = lines[i_ing + 1 :]
+        idx = find_first_step_marker(block)
+        if idx is None:
+            ingredients_txt = "\n".join(block).strip()
+        else:
             ingredients_txt = "\n".join(block[:idx]).strip()
             steps_txt = "\n".join(block[idx:]).strip()
             notes.append("steps_fallback_detected")
@@ -562,19 +879,17 @@ def split_sections(text: str) -> Dict[str, str]:
 def lines_to_list(block: str) -> List[str]:
     out: List[str] = []
     for l in block.splitlines():
-        l = re.sub(r"^[\-•*\+\d.\)\s]+", "", l).strip()
+        l = LIST_MARK_RE.sub("", l).strip()
         if l:
             out.append(l)
     return out
 
 
 def normalize_qty_line(line: str) -> str:
-    line = line.replace("–", "-").replace("—", "-")
-    line = re.sub(r"(\d)\s*[xX]\s*(\d)", r"\1 x \2", line)
-    line = re.sub(r"(\d)([¼½¾⅓⅔⅛⅜⅝⅞])", r"\1 \2", line)
-    for k, v in FRACTIONS_MAP.items():
-        line = line.replace(k, v)
-    m = re.match(r"^\s*(\d+)\s*\(([^)]+)\)\s*(.+)$", line)
+    line = TIMES_RE.sub(r"\1 x \2", line)
+    line = FRACTION_SPLIT_RE.sub(r"\1 \2", line)
+    line = line.translate(QTY_CHAR_TRANS)
+    m = QTY_PAREN_RE.match(line)
     if m:
         line = f"{m.group(1)} {m.group(2)} {m.group(3)}"
     return line
@@ -583,24 +898,24 @@ def parse_ingredients_lines(block: str) -> Dict[str, List[str]]:
     valid: List[str] = []
     invalid: List[str] = []
     raw_lines = [
-        re.sub(r"^[\-•*+]+\s*", "", raw).strip()
+        BULLET_RE.sub("", raw).strip()
         for raw in block.splitlines()
     ]
     lines = [l for l in raw_lines if l]
     i = 0
     while i < len(lines):
         line = lines[i]
-        if line.endswith(":") and not re.search(r"\d", line):
+        if line.endswith(":") and not DIGIT_RE.search(line):
             i += 1
             continue
-        if SKIP_INGR_LINE_RE.search(line) or SKIP_INGR_SIMPLE_RE.match(line):
+        if SKIP_INGR_RE.match(line):
             i += 1
             continue
 
         # If quantity is on its own line, merge with next line.
         if QTY_ONLY_RE.match(line) and i + 1 < len(lines):
             nxt = lines[i + 1]
-            if not SKIP_INGR_LINE_RE.search(nxt) and not re.search(r"\d", nxt):
+            if not SKIP_INGR_LINE_RE.search(nxt) and not DIGIT_RE.search(nxt):
                 line = f"{line} {nxt}"
                 i += 1
 
@@ -622,9 +937,11 @@ def parse_ingredients_lines(block: str) -> Dict[str, List[str]]:
     return {"valid": valid, "invalid": invalid}
 
 
+PORTIONS_RE = re.compile(r"pour\s+(\d+)\s*(pers|personnes?)", re.I)
+
+
 def parse_portions(title: str, ingredients_raw: str, steps_raw: str) -> int:
-    text = " ".join([title or "", ingredients_raw or "", steps_raw or ""]).lower()
-    m = re.search(r"pour\s+(\d+)\s*(pers|personnes?)", text)
+    m = PORTIONS_RE.search(" ".join([title or "", ingredients_raw or "", steps_raw or ""]))
     if m:
         try:
             return int(m.group(1))
@@ -635,6 +952,31 @@ def parse_portions(title: str, ingredients_raw: str, steps_raw: str) -> int:
 
 # ========== NUTRITION ==========
 
+def _cell_float(value) -> float:
+    # Lenient: "12,5" (decimal comma) reads as 12.5; blank or junk cells ("n/a") count as 0.
+    try:
+        return float(str(value or 0).replace(",", "."))
+    except ValueError:
+        return 0.0
+
+
+def _cast_macros(rows: List[Dict]) -> List[Dict]:
+    # Parse the numeric columns once; compute_nutrition reads them per ingredient.
+    # A bad cell only zeroes that value, it never discards the table.
+    for row in rows:
+        for k in ("food", "aliases", "unit"):
+            if row.get(k) is None:  # DictReader fills short rows with None
+                row[k] = ""
+        row["_macros"] = tuple(
+            _cell_float(row.get(k))
+            for k in ("kcal_per_100g", "protein_g_per_100g", "fat_g_per_100g", "carb_g_per_100g")
+        )
+        row["_gpu"] = _cell_float(row.get("grams_per_unit"))
+        # Spoon and cup conversions only care whether the food is an oil.
+        row["_is_oil"] = "huile" in deaccent((row["food"] + "|" + row["aliases"]).lower())
+    return rows
+
+
 def load_nutrition_table() -> List[Dict]:
     builtin = [
         {"food": "poulet", "aliases": "blanc de poulet|poulet", "unit": "g", "grams_per_unit": "",
@@ -657,29 +999,77 @@ def load_nutrition_table() -> List[Dict]:
         try:
             with NUTRION_CSV.open("r", encoding="utf-8") as f:
                 rdr = csv.DictReader(f, delimiter=";")
-                rows = [dict(r) for r in rdr]
-            # merge: external rows override builtin for same food
-            existing = {deaccent(r["food"].lower()): r for r in rows if r.get("food")}
-            for b in builtin:
-                key = deaccent(b["food"].lower())
-                if key not in existing:
-                    rows.append(b)
-            return rows
+                rows = list(rdr)  # DictReader already yields a fresh dict per row
         except Exception as e:
             print(f"⚠️ Failed to read {NUTRION_CSV}: {e}. Using builtin table only.")
-    return builtin
+        else:
+            # merge: external rows override builtin for same food
+            existing = {deaccent(r["food"].lower()) for r in rows if r.get("food")}
+            rows.extend(b for b in builtin if deaccent(b["food"].lower()) not in existing)
+            return _cast_macros(rows)
+    return _cast_macros(builtin)
 
 
 NUTRI = load_nutrition_table()
 
+
+def build_food_matcher(rows: List[Dict]):
+    """One alternation over every food/alias token, plus token -> best row index.
+
+    The alternation sits in a zero-width lookahead, so finditer tries every
+    position and overlapping tokens ("huile olive" / "olive noire") are all
+    seen. At a given position only the longest token is reported, so a token
+    also inherits the rank of any shorter token it contains. The minimum rank
+    over all hits is the first row the old per-row scan would have matched.
+    """
+    token_rank: Dict[str, int] = {}
+    for idx, row in enumerate(rows):
+        tokens = [deaccent(row["food"].lower())]
+        if row.get("aliases"):
+            tokens += [deaccent(a.lower()) for a in row["aliases"].split("|")]
+        for t in tokens:
+            if t and t not in token_rank:
+                token_rank[t] = idx
+    if not token_rank:
+        return None, {}
+    # A token contained in t at word boundaries is a slice of t between two of
+    # t's own \b positions, so look those slices up instead of pairing tokens.
+    own_rank = dict(token_rank)
+    for t in own_rank:
+        cuts = [m.start() for m in re.finditer(r"\b", t)]
+        for k, i in enumerate(cuts):
+            for j in cuts[k + 1:]:
+                rank = own_rank.get(t[i:j])
+                if rank is not None and rank < token_rank[t]:
+                    token_rank[t] = rank
+    ordered = sorted(token_rank, key=len, reverse=True)
+    pattern = re.compile(r"(?=\b(" + "|".join(map(re.escape, ordered)) + r")\b)")
+    return pattern, token_rank
+
+
+FOOD_RE, FOOD_TOKEN_RANK = build_food_matcher(NUTRI)
+
+# Multi-letter units come before the bare "g"/"l" so that "grammes" or
+# "gousses" are not cut short to "g" by the alternation.
 QTY_RE = re.compile(
-    r"(?P<num>(\d+[.,]?\d*|\d+\s*/\s*\d+|[½¼¾⅓⅔]))\s*"
-    r"(?P<unit>g|grammes?|ml|cl|l|cs|càs|càc|cc|cuill(?:ere|ère)s?\s?(?:soupe|cafe|café)?|"
-    r"pinc(?:e|ée)s?|tranches?|gousses?|boi(?:te|îte)s?|sachets?|verres?|tasses?|cups?|pi[eè]ces?)",
+    r"(?P<num>\d+[.,]?\d*|\d+\s*/\s*\d+|[½¼¾⅓⅔])\s*"
+    r"(?P<unit>grammes?|gousses?|ml|cl|cs|càs|càc|cc|cuill(?:ere|ère)s?\s?(?:soupe|cafe|café)?|"
+    r"pinc(?:e|ée)s?|tranches?|boi(?:te|îte)s?|sachets?|verres?|tasses?|cups?|pi[eè]ces?|g|l)",
     re.I,
 )
 
 
+PIECE_UNIT_RE = re.compile(r"pi[eè]ces?|gousses?|tranches?")
+# Fixed unit -> grams/ml factors; spoons and cups depend on the food instead.
+UNIT_FACTORS = {
+    "cc": 5.0, "cuillère cafe": 5.0, "cuillere cafe": 5.0, "café": 5.0,
+    "ml": 1.0, "cl": 10.0, "l": 1000.0,
+    "g": 1.0, "gramme": 1.0,
+}
+SPOON_UNITS = {"cs", "cuillère soupe", "cuillere soupe"}
+CUP_UNITS = {"cups", "cup", "tasse", "tasses", "verre", "verres"}
+
+
 def _to_float(num_str: str) -> float:
     num_str = num_str.strip().replace(",", ".")
     map_unicode = {"½": "1/2", "¼": "1/4", "¾": "3/4", "⅓": "1/3", "⅔": "2/3"}
@@ -690,49 +1080,43 @@ def _to_float(num_str: str) -> float:
     return float(num_str)
 
 
+# The same ingredient lines ("2 gousses d'ail", "sel, poivre") recur across
+# many recipes, so remember the row each one resolved to.
+@lru_cache(maxsize=4096)
 def match_food(line: str) -> Optional[Dict]:
-    base = " " + re.sub(r"[^a-z0-9]+", " ", deaccent(line.lower())) + " "
-    for row in NUTRI:
-        tokens = [deaccent(row["food"].lower())]
-        if row.get("aliases"):
-            tokens += [deaccent(a.lower()) for a in row["aliases"].split("|")]
-        for t in tokens:
-            if t and re.search(rf"\b{re.escape(t)}\b", base):
-                return row
-    return None
+    if FOOD_RE is None:
+        return None
+    text = NON_ALNUM_RE.sub(" ", deaccent(line.lower()))
+    # Lines without a single letter ("200", "- 2 -") cannot name a food.
+    if not ALPHA_RE.search(text):
+        return None
+    base = " " + text + " "
+    best = min((FOOD_TOKEN_RANK[m.group(1)] for m in FOOD_RE.finditer(base)), default=None)
+    return None if best is None else NUTRI[best]
 
 
 def parse_quantity(line: str, row: Dict) -> float:
     m = QTY_RE.search(line)
     if not m:
         if (row.get("unit") or "") == "unit":
-            return float(row.get("grams_per_unit") or 100.0)
+            return row["_gpu"] if row.get("grams_per_unit") else 100.0
         return 100.0
 
     val = _to_float(m.group("num"))
     unit = m.group("unit").lower()
     unit = unit.replace("grammes", "g").replace("càs", "cs").replace("càc", "cc")
 
-    alias_all = deaccent((row.get("food", "") + "|" + row.get("aliases", "")).lower())
-
-    if unit in ("cs", "cuillère soupe", "cuillere soupe"):
-        return val * (15.0 if "huile" in alias_all else 12.0)
-    if unit in ("cc", "cuillère cafe", "cuillere cafe", "café"):
-        return val * 5.0
-    if unit == "ml":
-        return val
-    if unit == "cl":
-        return val * 10.0
-    if unit == "l":
-        return val * 1000.0
-    if re.search(r"pi[eè]ces?|gousses?|tranches?", unit):
-        grams = float(row.get("grams_per_unit") or 0) or (30.0 if "tranche" in unit else 5.0)
+    if unit in SPOON_UNITS:
+        return val * (15.0 if row["_is_oil"] else 12.0)
+    factor = UNIT_FACTORS.get(unit)
+    if factor is not None:
+        return val * factor
+    if PIECE_UNIT_RE.search(unit):
+        grams = row["_gpu"] or (30.0 if "tranche" in unit else 5.0)
         return val * grams
-    if unit in ("cups", "cup", "tasse", "tasses", "verre", "verres"):
-        base_ml = 220.0 if "huile" in alias_all else 240.0
+    if unit in CUP_UNITS:
+        base_ml = 220.0 if row["_is_oil"] else 240.0
         return val * base_ml
-    if unit in ("g", "gramme"):
-        return val
     return val * 100.0
 
 
@@ -744,10 +1128,7 @@ def compute_nutrition(ingredients: List[str], portions: int) -> Dict:
         if not row:
             continue
         qty_g = parse_quantity(line, row)
-        kcal100 = float(row.get("kcal_per_100g") or 0)
-        p100 = float(row.get("protein_g_per_100g") or 0)
-        f100 = float(row.get("fat_g_per_100g") or 0)
-        c100 = float(row.get("carb_g_per_100g") or 0)
+        kcal100, p100, f100, c100 = row["_macros"]
 
         totals["kcal"] += kcal100 * qty_g / 100.0
         totals["prot"] += p100 * qty_g / 100.0
@@ -772,140 +1153,193 @@ def compute_nutrition(ingredients: List[str], portions: int) -> Dict:
 
 # ========== MAIN PIPELINE ==========
 
+def dump_index_entry(entry: Dict) -> str:
+    # Same layout as json.dumps(ensure_ascii=False, indent=2); orjson is optional and faster.
+    if orjson is not None:
+        return orjson.dumps(entry, option=orjson.OPT_INDENT_2).decode("utf-8")
+    return json.dumps(entry, ensure_ascii=False, indent=2)
+
+
+def process_file(creds, it: Dict,
+                 parse_pool: Optional[ProcessPoolExecutor] = None,
+                 text_cache: Optional[TextCache] = None) -> Optional[Tuple[Dict, List]]:
+    """Extract, parse and score one Drive file.
+
+    Returns (index entry, nutrition row), or None when no text could be extracted.
+    """
+    name = it["name"]
+    fid = it["id"]
+    mt = it["mimeType"]
+
+    if text_cache is None:
+        text = extract_recipe_text(creds, it, parse_pool)
+    else:
+        text = cached_recipe_text(creds, it, text_cache, parse_pool)
+    if not text:
+        return None
+
+    sections = split_sections(text)
+    parsed_ing = parse_ingredients_lines(sections["ingredients"])
+    ingredients_list = parsed_ing["valid"][:120]
+    steps_list = lines_to_list(sections["steps"])[:200]
+    if not steps_list and sections["steps"].strip():
+        steps_list = [l.strip() for l in sections["steps"].splitlines() if l.strip()][:200]
+    portions = parse_portions(name, sections["ingredients"], sections["steps"])
+
+    status = sections.get("status", "INCOMPLETE")
+    notes = sections.get("notes", [])
+
+    if parsed_ing["invalid"]:
+        if ingredients_list and steps_list:
+            status = "PARTIAL"
+            notes = notes + ["partial_invalid_ingredients"]
+        else:
+            status = "INCOMPLETE"
+            notes = notes + ["invalid_ingredient_lines"]
+    if not ingredients_list or not steps_list:
+        status = "INCOMPLETE"
+        if not ingredients_list:
+            notes = notes + ["no_valid_ingredients"]
+        if not steps_list:
+            notes = notes + ["no_steps"]
+
+    nutr = compute_nutrition(ingredients_list, portions) if status == "CONFIDENT" else {
+        "total_kcal": 0,
+        "kcal_per_portion": 0,
+        "proteins_g": 0,
+        "lipids_g": 0,
+        "carbs_g": 0,
+        "nutrition_details": [],
+    }
+
+    created = it.get("createdTime", "")
+    modified = it.get("modifiedTime", "")
+    web = f"https://drive.google.com/file/d/{fid}/view"
+    full_path = it.get("fullPath", name)
+
+    entry = {
+        "title": name,
+        "normalized_title": normalize_title(name),
+        "title_key": title_key(name),
+        "file_id": fid,
+        "mimeType": mt,
+        "webViewLink": web,
+        "fullPath": full_path,
+        "createdTime": created,
+        "modifiedTime": modified,
+        "ingredients_raw": sections["ingredients"],
+        "steps_raw": sections["steps"],
+        "ingredients": ingredients_list,
+        "steps": steps_list,
+        "parse_status": status,
+        "parse_notes": notes,
+        "ingredients_invalid": parsed_ing["invalid"],
+        **nutr,
+    }
+    nutrition_row = [
+        name,
+        portions,
+        nutr["total_kcal"],
+        nutr["kcal_per_portion"],
+        nutr["proteins_g"],
+        nutr["lipids_g"],
+        nutr["carbs_g"],
+    ]
+    return entry, nutrition_row
+
+
+def parse_mp_context():
+    # Parse workers are started lazily from the download threads, which hold HTTP
+    # and sqlite locks; forking there could copy a held lock into the child.
+    method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+    return multiprocessing.get_context(method)
+
+
 def main():
-    service = build_drive_service()
+    creds = load_credentials()
+    service = build_drive_service(creds)
     folder_id = get_or_save_folder_id(service, "Recettes")
 
     print("🔁 Scanning 'Recettes' folder tree...")
-    files = list_tree(service, folder_id)
+    files = list_tree(service, folder_id, creds)
     print(f"📂 {len(files)} file(s) found in 'Recettes'.")
 
-    index: List[Dict] = []
-    nutrition_rows: List[List] = []
+    text_cache = TextCache(TEXT_CACHE_DB)
 
-    for k, it in enumerate(files, 1):
-        name = it["name"]
-        fid = it["id"]
-        mt = it["mimeType"]
-        print(f"[{k}/{len(files)}] ↪ {name} ({mt})")
+    def run(it: Dict) -> Optional[Tuple[Dict, List]]:
+        return process_file(creds, it, parse_pool, text_cache)
 
-        try:
-            text = extract_recipe_text(service, it)
-            if not text:
-                print("   (empty or unsupported format)")
-                continue
-
-            sections = split_sections(text)
-            parsed_ing = parse_ingredients_lines(sections["ingredients"])
-            ingredients_list = parsed_ing["valid"][:120]
-            steps_list = lines_to_list(sections["steps"])[:200]
-            if not steps_list and sections["steps"].strip():
-                steps_list = [l.strip() for l in sections["steps"].splitlines() if l.strip()][:200]
-            portions = parse_portions(name, sections["ingredients"], sections["steps"])
-
-            status = sections.get("status", "INCOMPLETE")
-            notes = sections.get("notes", [])
-
-            if parsed_ing["invalid"]:
-                if ingredients_list and steps_list:
-                    status = "PARTIAL"
-                    notes = notes + ["partial_invalid_ingredients"]
-                else:
-                    status = "INCOMPLETE"
-                    notes = notes + ["invalid_ingredient_lines"]
-            if not ingredients_list or not steps_list:
-                status = "INCOMPLETE"
-                if not ingredients_list:
-                    notes = notes + ["no_valid_ingredients"]
-                if not steps_list:
-                    notes = notes + ["no_steps"]
-
-            nutr = compute_nutrition(ingredients_list, portions) if status == "CONFIDENT" else {
-                "total_kcal": 0,
-                "kcal_per_portion": 0,
-                "proteins_g": 0,
-                "lipids_g": 0,
-                "carbs_g": 0,
-                "nutrition_details": [],
-            }
-
-            created = it.get("createdTime", "")
-            modified = it.get("modifiedTime", "")
-            web = f"https://drive.google.com/file/d/{fid}/view"
-            full_path = it.get("fullPath", name)
-
-            entry = {
-                "title": name,
-                "normalized_title": normalize_title(name),
-                "title_key": title_key(name),
-                "file_id": fid,
-                "mimeType": mt,
-                "webViewLink": web,
-                "fullPath": full_path,
-                "createdTime": created,
-                "modifiedTime": modified,
-                "ingredients_raw": sections["ingredients"],
-                "steps_raw": sections["steps"],
-                "ingredients": ingredients_list,
-                "steps": steps_list,
-                "parse_status": status,
-                "parse_notes": notes,
-                "ingredients_invalid": parsed_ing["invalid"],
-                **nutr,
-            }
-            index.append(entry)
-
-            nutrition_rows.append(
-                [
-                    name,
-                    portions,
-                    nutr["total_kcal"],
-                    nutr["kcal_per_portion"],
-                    nutr["proteins_g"],
-                    nutr["lipids_g"],
-                    nutr["carbs_g"],
-                ]
+    # Outputs are written as each file is processed, so no full index is held
+    # in memory. The JSON array is assembled by hand with the same layout
+    # json.dump(..., indent=2) would produce. Writes go to .tmp files that only
+    # replace the real ones once complete: the backend reads them live, and an
+    # interrupted scan must not leave a partial CSV or unterminated JSON behind.
+    count = 0
+    tmp_out = {path: path.with_name(path.name + ".tmp") for path in (OUT_JSON, OUT_CSV, OUT_NUTR)}
+    try:
+        with tmp_out[OUT_JSON].open("w", encoding="utf-8") as fj, \
+                tmp_out[OUT_CSV].open("w", encoding="utf-8", newline="") as fc, \
+                tmp_out[OUT_NUTR].open("w", encoding="utf-8", newline="") as fn:
+            list_writer = csv.writer(fc, delimiter=";")
+            list_writer.writerow(
+                ["title", "file_id", "mimeType", "webViewLink", "fullPath", "createdTime", "modifiedTime",
+                 "ingredients_count", "steps_count"]
             )
+            nutr_writer = csv.writer(fn, delimiter=";")
+            nutr_writer.writerow(
+                ["title", "portions", "total_kcal", "kcal_per_portion", "proteins_g", "lipids_g", "carbs_g"]
+            )
+            fj.write("[")
+
+            # Each file is downloaded, parsed and scored in a worker; results are
+            # collected in listing order so the outputs stay deterministic.
+            with ProcessPoolExecutor(max_workers=PARSE_PROCESSES, mp_context=parse_mp_context()) as parse_pool, \
+                    ThreadPoolExecutor(max_workers=EXTRACT_WORKERS) as pool:
+                futures = [pool.submit(run, it) for it in files]
+                for k, (it, fut) in enumerate(zip(files, futures), 1):
+                    name = it["name"]
+                    print(f"[{k}/{len(files)}] ↪ {name} ({it['mimeType']})")
+                    try:
+                        result = fut.result()
+                    except Exception as e:
+                        print(f"   ⚠️ Extraction failed for {name}: {e}")
+                        continue
+                    if result is None:
+                        print("   (empty or unsupported format)")
+                        continue
+                    e, nutrition_row = result
+
+                    fj.write(",\n  " if count else "\n  ")
+                    fj.write(dump_index_entry(e).replace("\n", "\n  "))
+                    list_writer.writerow(
+                        [
+                            e["title"],
+                            e["file_id"],
+                            e["mimeType"],
+                            e["webViewLink"],
+                            e["fullPath"],
+                            e["createdTime"],
+                            e["modifiedTime"],
+                            len(e["ingredients"]),
+                            len(e["steps"]),
+                        ]
+                    )
+                    nutr_writer.writerow(nutrition_row)
+                    count += 1
+
+            fj.write("\n]" if count else "]")
+    except BaseException:
+        for tmp in tmp_out.values():
+            tmp.unlink(missing_ok=True)
+        raise
+    for path, tmp in tmp_out.items():
+        os.replace(tmp, path)
+
+    text_cache.prune(it["id"] for it in files)
+    text_cache.close()
 
-        except Exception as e:
-            print(f"   ⚠️ Extraction failed for {name}: {e}")
-
-    # ----- Save JSON index -----
-    with OUT_JSON.open("w", encoding="utf-8") as f:
-        json.dump(index, f, ensure_ascii=False, indent=2)
     print(f"✅ Enriched JSON index : {OUT_JSON}")
-
-    # ----- Save recipes_list.csv -----
-    with OUT_CSV.open("w", encoding="utf-8", newline="") as f:
-        writer = csv.writer(f, delimiter=";")
-        writer.writerow(
-            ["title", "file_id", "mimeType", "webViewLink", "fullPath", "createdTime", "modifiedTime",
-             "ingredients_count", "steps_count"]
-        )
-        for e in index:
-            writer.writerow(
-                [
-                    e["title"],
-                    e["file_id"],
-                    e["mimeType"],
-                    e["webViewLink"],
-                    e["fullPath"],
-                    e["createdTime"],
-                    e["modifiedTime"],
-                    len(e["ingredients"]),
-                    len(e["steps"]),
-                ]
-            )
     print(f"✅ Files summary       : {OUT_CSV}")
-
-    # ----- Save recipes_nutrition.csv -----
-    with OUT_NUTR.open("w", encoding="utf-8", newline="") as f:
-        writer = csv.writer(f, delimiter=";")
-        writer.writerow(
-            ["title", "portions", "total_kcal", "kcal_per_portion", "proteins_g", "lipids_g", "carbs_g"]
-        )
-        for row in nutrition_rows:
-            writer.writerow(row)
     print(f"✅ Nutrition summary   : {OUT_NUTR}")
 
 
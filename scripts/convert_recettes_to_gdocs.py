@@ -4,8 +4,10 @@ import csv
 import hashlib
 import json
 import os
-import re
 import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
 
 from google.oauth2.credentials import Credentials
@@ -39,20 +41,34 @@ def resolve_oauth_token_file() -> str:
 
 def sanitize_doc_name(name: str) -> str:
     base = name.strip()
-    base = re.sub(r"\.pdf$", "", base, flags=re.IGNORECASE)
-    base = re.sub(r"\s+", " ", base).strip()
-    return base
+    if base[-4:].lower() == ".pdf":
+        base = base[:-4]
+    return " ".join(base.split())
 
 
-def file_md5(path: Path) -> str:
-    h = hashlib.md5()
+def file_digest(path: Path) -> str:
+    # Only used to spot identical PDFs within a run, so any fast hash will do.
     with path.open("rb") as f:
+        if hasattr(hashlib, "file_digest"):  # Python 3.11+: the read loop runs in C
+            return hashlib.file_digest(f, "blake2b").hexdigest()
+        h = hashlib.blake2b()
         for chunk in iter(lambda: f.read(1024 * 1024), b""):
             h.update(chunk)
     return h.hexdigest()
 
 
-def get_drive_client():
+# Refresh tokens about to expire before the run, not mid-request.
+TOKEN_REFRESH_MARGIN = timedelta(minutes=5)
+
+
+def token_expires_soon(creds) -> bool:
+    if not creds.expiry:
+        return False
+    # google-auth keeps expiry as naive UTC
+    return creds.expiry - datetime.now(timezone.utc).replace(tzinfo=None) < TOKEN_REFRESH_MARGIN
+
+
+def get_drive_credentials():
     oauth_client = resolve_oauth_client_file()
     if not oauth_client:
         print("Missing OAuth client. Set DRIVE_OAUTH_CLIENT or MEAL_PLANNER_SECRETS_DIR.")
@@ -63,6 +79,9 @@ def get_drive_client():
     creds = None
     if os.path.exists(token_path):
         creds = Credentials.from_authorized_user_file(token_path, scopes=scopes)
+    if creds and creds.valid and creds.refresh_token and token_expires_soon(creds):
+        creds.refresh(Request())
+        Path(token_path).write_text(creds.to_json(), encoding="utf-8")
     if not creds or not creds.valid:
         if creds and creds.expired and creds.refresh_token:
             creds.refresh(Request())
@@ -71,7 +90,22 @@ def get_drive_client():
             oauth_port = int(os.environ.get("DRIVE_OAUTH_PORT", "3002"))
             creds = flow.run_local_server(port=oauth_port, prompt="consent")
         Path(token_path).write_text(creds.to_json(), encoding="utf-8")
-    return build("drive", "v3", credentials=creds)
+    return creds
+
+
+def get_drive_client(creds=None):
+    return build("drive", "v3", credentials=creds or get_drive_credentials(), cache_discovery=False)
+
+
+_thread_local = threading.local()
+
+
+def thread_drive_client(creds):
+    # httplib2 connections are not thread-safe: one Drive client per worker thread.
+    drive = getattr(_thread_local, "drive", None)
+    if drive is None:
+        drive = _thread_local.drive = get_drive_client(creds)
+    return drive
 
 
 def ensure_folder(drive, folder_name: str) -> str:
@@ -80,8 +114,8 @@ def ensure_folder(drive, folder_name: str) -> str:
             f"name = '{folder_name}' and mimeType = 'application/vnd.google-apps.folder' "
             "and trashed = false"
         ),
-        fields="files(id, name)",
-        pageSize=10,
+        fields="files(id)",
+        pageSize=1,
     ).execute()
     files = resp.get("files", [])
     if files:
@@ -96,17 +130,25 @@ def ensure_folder(drive, folder_name: str) -> str:
     return created["id"]
 
 
-def find_existing_doc(drive, folder_id: str, doc_name: str):
-    resp = drive.files().list(
-        q=(
-            f"'{folder_id}' in parents and name = '{doc_name}' "
-            "and mimeType = 'application/vnd.google-apps.document' and trashed = false"
-        ),
-        fields="files(id, name, webViewLink)",
-        pageSize=1,
-    ).execute()
-    files = resp.get("files", [])
-    return files[0] if files else None
+def list_existing_docs(drive, folder_id: str) -> dict:
+    # One paginated listing of the folder instead of a name query per PDF.
+    docs = {}
+    page_token = None
+    while True:
+        resp = drive.files().list(
+            q=(
+                f"'{folder_id}' in parents "
+                "and mimeType = 'application/vnd.google-apps.document' and trashed = false"
+            ),
+            fields="nextPageToken, files(id, name, webViewLink)",
+            pageSize=1000,
+            pageToken=page_token,
+        ).execute()
+        for f in resp.get("files", []):
+            docs.setdefault(f["name"], f)
+        page_token = resp.get("nextPageToken")
+        if not page_token:
+            return docs
 
 
 def convert_pdf_to_doc(drive, pdf_path: Path, folder_id: str, doc_name: str):
@@ -127,6 +169,7 @@ def main():
     parser.add_argument("--out", default="/Users/Jerome/meal-planner-docker-auto", help="Report output dir")
     parser.add_argument("--limit", type=int, default=0, help="Max files to convert (0=all)")
     parser.add_argument("--dry-run", action="store_true", help="List what would be converted")
+    parser.add_argument("--workers", type=int, default=8, help="Parallel uploads")
     args = parser.parse_args()
 
     src_dir = Path(args.src).expanduser().resolve()
@@ -155,10 +198,20 @@ def main():
         print(json.dumps({"ok": True, "dry_run": True, "total": len(pdfs)}))
         return 0
 
-    drive = get_drive_client()
+    creds = get_drive_credentials()
+    drive = get_drive_client(creds)
     folder_id = ensure_folder(drive, args.dest_folder)
+    existing_docs = list_existing_docs(drive, folder_id)
+
+    def fail(entry, e):
+        entry.update({"status": "failed", "error": str(e)})
+        report["failed"] += 1
 
+    # Hashing and existence checks run here; uploads are queued and run in parallel.
+    # Report items keep the source order: queued entries are filled in on completion.
     seen_hashes = {}
+    uploads = {}      # doc_name -> (pdf, entry) for the first PDF queued under that name
+    same_name = []    # (pdf, entry, first entry) for later PDFs with an already queued name
     for idx, pdf in enumerate(pdfs, start=1):
         doc_name = sanitize_doc_name(pdf.name)
         entry = {
@@ -167,18 +220,23 @@ def main():
             "status": "",
         }
         try:
-            md5 = file_md5(pdf)
-            if md5 in seen_hashes:
+            digest = file_digest(pdf)
+            if digest in seen_hashes:
                 entry.update({
                     "status": "duplicate_hash",
-                    "duplicate_of": seen_hashes[md5],
+                    "duplicate_of": seen_hashes[digest],
                 })
                 report["skipped"] += 1
                 report["items"].append(entry)
                 continue
-            seen_hashes[md5] = pdf.name
+            seen_hashes[digest] = pdf.name
 
-            existing = find_existing_doc(drive, folder_id, doc_name)
+            if doc_name in uploads:
+                same_name.append((pdf, entry, uploads[doc_name][1]))
+                report["items"].append(entry)
+                continue
+
+            existing = existing_docs.get(doc_name)
             if existing:
                 entry.update({
                     "status": "already_exists",
@@ -189,20 +247,61 @@ def main():
                 report["items"].append(entry)
                 continue
 
-            created = convert_pdf_to_doc(drive, pdf, folder_id, doc_name)
-            entry.update({
-                "status": "converted",
-                "doc_id": created.get("id"),
-                "webViewLink": created.get("webViewLink"),
-            })
-            report["converted"] += 1
+            uploads[doc_name] = (pdf, entry)
             report["items"].append(entry)
         except Exception as e:
-            entry.update({"status": "failed", "error": str(e)})
-            report["failed"] += 1
+            fail(entry, e)
             report["items"].append(entry)
         if idx % 25 == 0:
-            print(f"[{idx}/{len(pdfs)}] processed")
+            print(f"[{idx}/{len(pdfs)}] checked")
+
+    def upload(pdf, doc_name):
+        return convert_pdf_to_doc(thread_drive_client(creds), pdf, folder_id, doc_name)
+
+    with ThreadPoolExecutor(max_workers=max(1, args.workers)) as pool:
+        futures = {pool.submit(upload, pdf, doc_name): entry for doc_name, (pdf, entry) in uploads.items()}
+        for done, fut in enumerate(as_completed(futures), start=1):
+            entry = futures[fut]
+            try:
+                created = fut.result()
+            except Exception as e:
+                fail(entry, e)
+            else:
+                entry.update({
+                    "status": "converted",
+                    "doc_id": created.get("id"),
+                    "webViewLink": created.get("webViewLink"),
+                })
+                report["converted"] += 1
+            if done % 25 == 0:
+                print(f"[{done}/{len(futures)}] uploaded")
+
+    # A later PDF with the same name reuses the doc created for the first one, as the
+    # existence check did when uploads ran one by one; it only uploads if that one failed.
+    by_name = {}
+    for pdf, entry, first in same_name:
+        name = entry["doc_name"]
+        first = by_name.get(name, first)
+        if first["status"] == "converted":
+            entry.update({
+                "status": "already_exists",
+                "doc_id": first.get("doc_id"),
+                "webViewLink": first.get("webViewLink"),
+            })
+            report["skipped"] += 1
+            continue
+        try:
+            created = convert_pdf_to_doc(drive, pdf, folder_id, name)
+        except Exception as e:
+            fail(entry, e)
+            continue
+        entry.update({
+            "status": "converted",
+            "doc_id": created.get("id"),
+            "webViewLink": created.get("webViewLink"),
+        })
+        report["converted"] += 1
+        by_name[name] = entry
 
     write_reports(report, args.out)
     print(json.dumps({"ok": True, "converted": report["converted"], "failed": report["failed"]}))
@@ -219,8 +318,8 @@ def write_reports(report, out_dir):
     with csv_path.open("w", newline="", encoding="utf-8") as f:
         writer = csv.writer(f)
         writer.writerow(["file", "doc_name", "status", "doc_id", "webViewLink", "error", "duplicate_of"])
-        for it in report.get("items", []):
-            writer.writerow([
+        writer.writerows(
+            [
                 it.get("file", ""),
                 it.get("doc_name", ""),
                 it.get("status", ""),
@@ -228,7 +327,9 @@ def write_reports(report, out_dir):
                 it.get("webViewLink", ""),
                 it.get("error", ""),
                 it.get("duplicate_of", ""),
-            ])
+            ]
+            for it in report.get("items", [])
+        )
 
 
 if __name__ == "__main__":
@@ -1,14 +1,23 @@
 #!/usr/bin/env python3
 import argparse
 import os
+import random
 import re
 import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta, timezone
+from itertools import islice
 from pathlib import Path
 
 from google.oauth2.credentials import Credentials
 from google.auth.transport.requests import Request
+from google_auth_httplib2 import AuthorizedHttp
 from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
+from googleapiclient.http import build_http
 
 
 def resolve_oauth_token_file() -> str:
@@ -33,12 +42,26 @@ def resolve_oauth_client_file() -> str:
     return ""
 
 
-def get_drive_client():
+# Refresh tokens about to expire before the run, not mid-request.
+TOKEN_REFRESH_MARGIN = timedelta(minutes=5)
+
+
+def token_expires_soon(creds) -> bool:
+    if not creds.expiry:
+        return False
+    # google-auth keeps expiry as naive UTC
+    return creds.expiry - datetime.now(timezone.utc).replace(tzinfo=None) < TOKEN_REFRESH_MARGIN
+
+
+def get_drive_credentials():
     token_path = resolve_oauth_token_file()
     scopes = ["https://www.googleapis.com/auth/drive.file"]
     creds = None
     if os.path.exists(token_path):
         creds = Credentials.from_authorized_user_file(token_path, scopes=scopes)
+    if creds and creds.valid and creds.refresh_token and token_expires_soon(creds):
+        creds.refresh(Request())
+        Path(token_path).write_text(creds.to_json(), encoding="utf-8")
     if not creds or not creds.valid:
         if creds and creds.expired and creds.refresh_token:
             creds.refresh(Request())
@@ -50,21 +73,52 @@ def get_drive_client():
             oauth_port = int(os.environ.get("DRIVE_OAUTH_PORT", "3002"))
             creds = flow.run_local_server(port=oauth_port, prompt="consent")
         Path(token_path).write_text(creds.to_json(), encoding="utf-8")
-    return build("drive", "v3", credentials=creds)
+    return creds
+
+
+# Writes are one request per doc; run a few concurrently, within the Docs write quota.
+WRITE_WORKERS = 4
+RATE_LIMIT_RETRIES = 5
+
+_thread_local = threading.local()
+
+
+def thread_docs_service(creds):
+    # httplib2 connections are not thread-safe: one Docs client per worker thread.
+    docs_service = getattr(_thread_local, "docs_service", None)
+    if docs_service is None:
+        docs_service = _thread_local.docs_service = build("docs", "v1", credentials=creds, cache_discovery=False)
+    return docs_service
+
+
+def is_rate_limited(e: Exception) -> bool:
+    return isinstance(e, HttpError) and e.resp.status == 429
+
+
+def write_with_backoff(fn, *args):
+    # A 429 means the write was rejected, not applied, so it is safe to resend.
+    # Other errors are not retried: insertText is not idempotent.
+    for attempt in range(RATE_LIMIT_RETRIES):
+        try:
+            return fn(*args)
+        except HttpError as e:
+            if not is_rate_limited(e) or attempt == RATE_LIMIT_RETRIES - 1:
+                raise
+            time.sleep(2 ** attempt + random.random())
 
 
 def find_folder_id(drive, name: str) -> str:
     resp = drive.files().list(
         q=f"name = '{name}' and mimeType = 'application/vnd.google-apps.folder' and trashed = false",
-        fields="files(id, name)",
+        fields="files(id)",
         pageSize=10,
     ).execute()
     files = resp.get("files", [])
     return files[0]["id"] if files else ""
 
 
-def list_docs_in_folder(drive, folder_id: str):
-    docs = []
+def iter_docs_in_folder(drive, folder_id: str):
+    # Yields page by page, so a --limit run stops listing once it has enough docs.
     page_token = None
     while True:
         resp = drive.files().list(
@@ -72,19 +126,23 @@ def list_docs_in_folder(drive, folder_id: str):
                 f"'{folder_id}' in parents and "
                 "mimeType = 'application/vnd.google-apps.document' and trashed = false"
             ),
-            fields="nextPageToken, files(id, name)",
+            fields="nextPageToken, files(id)",
             pageSize=1000,
             pageToken=page_token,
         ).execute()
-        docs.extend(resp.get("files", []))
+        yield from resp.get("files", [])
         page_token = resp.get("nextPageToken")
         if not page_token:
             break
-    return docs
 
 
-def get_doc_text(docs_service, doc_id: str) -> str:
-    doc = docs_service.documents().get(documentId=doc_id).execute()
+# Docs batch requests accept up to 50 calls; only the text runs are fetched.
+DOCS_BATCH_SIZE = 50
+DOCS_RETRIES = 5
+DOC_TEXT_FIELDS = "body(content(paragraph(elements(textRun(content)))))"
+
+
+def doc_text(doc) -> str:
     parts = []
     for el in doc.get("body", {}).get("content", []):
         par = el.get("paragraph")
@@ -97,71 +155,96 @@ def get_doc_text(docs_service, doc_id: str) -> str:
     return "".join(parts)
 
 
-def extract_ingredients(text: str):
-    lines = [l.strip() for l in text.splitlines()]
-    ingredients = []
-    capture = False
-    for line in lines:
-        l = line.strip()
-        if not l:
-            if capture:
-                continue
-            continue
-        low = l.lower()
-        if "ingr" in low and "ingr" == low[:4]:
-            capture = True
-            continue
-        if capture:
-            if low.startswith("etape") or low.startswith("préparation") or low.startswith("preparation"):
-                break
-            if low.startswith("steps") or low.startswith("method"):
-                break
-            if l.startswith("-") or l.startswith("•") or re.match(r"^\d", l):
-                ingredients.append(l.lstrip("-•").strip())
-            else:
-                if len(l) <= 80:
-                    ingredients.append(l)
+def is_retryable_read(e: Exception) -> bool:
+    return isinstance(e, HttpError) and (e.resp.status == 429 or e.resp.status >= 500)
+
+
+def get_docs_text(docs_service, doc_ids):
+    # Sub-requests of a batch are not retried by googleapiclient: throttled or
+    # 5xx reads are fetched again one at a time with the plain (retrying) call.
+    texts = {}
+    retry = []
+    errors = []
+
+    def get(doc_id):
+        return docs_service.documents().get(documentId=doc_id, fields=DOC_TEXT_FIELDS)
+
+    def on_doc(request_id, response, exception):
+        if exception is None:
+            texts[request_id] = doc_text(response)
+        elif is_retryable_read(exception):
+            retry.append(request_id)
+        else:
+            errors.append(exception)
+
+    for start in range(0, len(doc_ids), DOCS_BATCH_SIZE):
+        chunk = doc_ids[start : start + DOCS_BATCH_SIZE]
+        batch = docs_service.new_batch_http_request(callback=on_doc)
+        for doc_id in chunk:
+            batch.add(get(doc_id), request_id=doc_id)
+        try:
+            batch.execute()
+        except Exception:
+            retry.extend(chunk)
+        if errors:
+            raise errors[0]
+
+    for doc_id in dict.fromkeys(retry):
+        if doc_id not in texts:
+            texts[doc_id] = doc_text(get(doc_id).execute(num_retries=DOCS_RETRIES))
+    return texts
+
+
+DIGIT_RE = re.compile(r"\d")
+# Lowercased line prefixes that open the steps section.
+STEP_HEADERS = ("etape", "préparation", "preparation", "steps", "method")
+
+
+def dedupe(items):
     seen = set()
     out = []
-    for i in ingredients:
-        key = re.sub(r"\s+", " ", i.lower()).strip()
+    for i in items:
+        key = " ".join(i.lower().split())
         if key and key not in seen:
             out.append(i)
             seen.add(key)
     return out
 
 
-def extract_steps(text: str):
-    lines = [l.strip() for l in text.splitlines()]
+def extract_both(text: str):
+    # One pass over the lines: ingredients run from the first "ingr..." header up to
+    # the next steps header; steps are every line after any steps header.
+    ingredients = []
     steps = []
-    capture = False
-    for line in lines:
+    ing_state = "before"  # -> "in" at the ingredients header, "done" at the next steps header
+    in_steps = False
+    for line in text.splitlines():
         l = line.strip()
         if not l:
-            if capture:
-                continue
             continue
         low = l.lower()
-        if low.startswith("etape") or low.startswith("préparation") or low.startswith("preparation"):
-            capture = True
-            continue
-        if low.startswith("steps") or low.startswith("method"):
-            capture = True
-            continue
-        if capture:
-            if l.startswith("-") or l.startswith("•") or re.match(r"^\d", l):
+        is_step_header = low.startswith(STEP_HEADERS)
+        is_item = l.startswith(("-", "•")) or DIGIT_RE.match(l)
+
+        if ing_state != "done":
+            if low.startswith("ingr"):
+                ing_state = "in"
+            elif ing_state == "in":
+                if is_step_header:
+                    ing_state = "done"
+                elif is_item:
+                    ingredients.append(l.lstrip("-•").strip())
+                elif len(l) <= 80:
+                    ingredients.append(l)
+
+        if is_step_header:
+            in_steps = True
+        elif in_steps:
+            if is_item:
                 steps.append(l.lstrip("-•").strip())
-            else:
-                if len(l) <= 140:
-                    steps.append(l)
-    seen = set()
-    out = []
-    for s in steps:
-        key = re.sub(r"\s+", " ", s.lower()).strip()
-        if key and key not in seen:
-            out.append(s)
-            seen.add(key)
-    return out
+            elif len(l) <= 140:
+                steps.append(l)
+    return dedupe(ingredients), dedupe(steps)
 
 
 def insert_sections(docs_service, doc_id: str, ingredients, steps):
@@ -188,31 +271,45 @@ def main():
     parser = argparse.ArgumentParser(description="Auto-fix missing ingredients+steps in Google Docs")
     parser.add_argument("--folder", default="TO_FIX_missing_both", help="Drive folder to fix")
     parser.add_argument("--limit", type=int, default=0, help="Max docs to process (0=all)")
+    parser.add_argument("--workers", type=int, default=WRITE_WORKERS, help="Concurrent doc writes")
     args = parser.parse_args()
 
-    drive = get_drive_client()
-    docs_service = build("docs", "v1", credentials=drive._http.credentials)
+    creds = get_drive_credentials()
+    # One authorized Http (and one token) shared by the Drive and Docs clients.
+    http = AuthorizedHttp(creds, http=build_http())
+    drive = build("drive", "v3", http=http, cache_discovery=False)
+    docs_service = build("docs", "v1", http=http, cache_discovery=False)
 
     folder_id = find_folder_id(drive, args.folder)
     if not folder_id:
         raise SystemExit(f"Folder not found: {args.folder}")
 
-    docs = list_docs_in_folder(drive, folder_id)
-    if args.limit and args.limit > 0:
-        docs = docs[: args.limit]
+    limit = args.limit if args.limit and args.limit > 0 else None
+    docs = list(islice(iter_docs_in_folder(drive, folder_id), limit))
+
+    texts = get_docs_text(docs_service, [d["id"] for d in docs])
+
+    def fix(d):
+        text = texts[d["id"]]
+        ingredients, steps = extract_both(text)
+        return write_with_backoff(insert_sections, thread_docs_service(creds), d["id"], ingredients, steps)
 
     fixed = 0
-    skipped = 0
-    for d in docs:
-        text = get_doc_text(docs_service, d["id"])
-        ingredients = extract_ingredients(text)
-        steps = extract_steps(text)
-        ok = insert_sections(docs_service, d["id"], ingredients, steps)
-        if ok:
-            fixed += 1
-        else:
-            skipped += 1
-    print({"fixed": fixed, "skipped": skipped, "total": len(docs)})
+    throttled = []
+    errors = []
+    with ThreadPoolExecutor(max_workers=max(1, args.workers)) as pool:
+        futures = {pool.submit(fix, d): d for d in docs}
+        for fut in as_completed(futures):
+            try:
+                fixed += fut.result()
+            except Exception as e:
+                # Throttled docs were left untouched; a later run picks them up.
+                (throttled if is_rate_limited(e) else errors).append((futures[fut], e))
+    skipped = len(docs) - fixed - len(throttled) - len(errors)
+    print({"fixed": fixed, "skipped": skipped, "throttled": len(throttled), "failed": len(errors), "total": len(docs)})
+    if errors:
+        d, e = errors[0]
+        raise SystemExit(f"{len(errors)} doc(s) could not be fixed, first {d['id']}: {e}")
 
 
 if __name__ == "__main__":
@@ -1,14 +1,23 @@
 #!/usr/bin/env python3
 import argparse
 import os
+import random
 import re
 import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta, timezone
+from itertools import islice
 from pathlib import Path
 
 from google.oauth2.credentials import Credentials
 from google.auth.transport.requests import Request
+from google_auth_httplib2 import AuthorizedHttp
 from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
+from googleapiclient.http import build_http
 
 
 def resolve_oauth_token_file() -> str:
@@ -33,12 +42,26 @@ def resolve_oauth_client_file() -> str:
     return ""
 
 
-def get_drive_client():
+# Refresh tokens about to expire before the run, not mid-request.
+TOKEN_REFRESH_MARGIN = timedelta(minutes=5)
+
+
+def token_expires_soon(creds) -> bool:
+    if not creds.expiry:
+        return False
+    # google-auth keeps expiry as naive UTC
+    return creds.expiry - datetime.now(timezone.utc).replace(tzinfo=None) < TOKEN_REFRESH_MARGIN
+
+
+def get_drive_credentials():
     token_path = resolve_oauth_token_file()
     scopes = ["https://www.googleapis.com/auth/drive.file"]
     creds = None
     if os.path.exists(token_path):
         creds = Credentials.from_authorized_user_file(token_path, scopes=scopes)
+    if creds and creds.valid and creds.refresh_token and token_expires_soon(creds):
+        creds.refresh(Request())
+        Path(token_path).write_text(creds.to_json(), encoding="utf-8")
     if not creds or not creds.valid:
         if creds and creds.expired and creds.refresh_token:
             creds.refresh(Request())
@@ -50,21 +73,93 @@ def get_drive_client():
             oauth_port = int(os.environ.get("DRIVE_OAUTH_PORT", "3002"))
             creds = flow.run_local_server(port=oauth_port, prompt="consent")
         Path(token_path).write_text(creds.to_json(), encoding="utf-8")
-    return build("drive", "v3", credentials=creds)
+    return creds
+
+
+# Writes are one request per doc; run a few concurrently, within the Docs write quota.
+WRITE_WORKERS = 4
+RATE_LIMIT_RETRIES = 5
+
+_thread_local = threading.local()
+
+
+def thread_docs_service(creds):
+    # httplib2 connections are not thread-safe: one Docs client per worker thread.
+    docs_service = getattr(_thread_local, "docs_service", None)
+    if docs_service is None:
+        docs_service = _thread_local.docs_service = build("docs", "v1", credentials=creds, cache_discovery=False)
+    return docs_service
+
+
+# Drive batch requests accept up to 100 calls.
+DRIVE_BATCH_SIZE = 100
+DRIVE_RETRIES = 5
+
+
+def move_docs(drive, doc_ids, add_parent_id: str, remove_parent_id: str):
+    # Returns (doc_id, error) for the docs that could not be moved. Sub-requests
+    # of a batch are not retried by googleapiclient, so failed moves are sent
+    # again one at a time with the plain (retrying) call.
+    failed = []
+
+    def update(doc_id):
+        return drive.files().update(
+            fileId=doc_id,
+            addParents=add_parent_id,
+            removeParents=remove_parent_id,
+            fields="id",
+        )
+
+    def on_update(request_id, response, exception):
+        if exception is not None:
+            failed.append(doc_ids[int(request_id)])
+
+    for start in range(0, len(doc_ids), DRIVE_BATCH_SIZE):
+        batch = drive.new_batch_http_request(callback=on_update)
+        for i in range(start, min(start + DRIVE_BATCH_SIZE, len(doc_ids))):
+            batch.add(update(doc_ids[i]), request_id=str(i))
+        try:
+            batch.execute()
+        except Exception:
+            failed.extend(doc_ids[start : start + DRIVE_BATCH_SIZE])
+
+    errors = []
+    for doc_id in dict.fromkeys(failed):
+        try:
+            update(doc_id).execute(num_retries=DRIVE_RETRIES)
+        except Exception as e:
+            errors.append((doc_id, e))
+    return errors
+
+
+def is_rate_limited(e: Exception) -> bool:
+    return isinstance(e, HttpError) and e.resp.status == 429
+
+
+def write_with_backoff(fn, *args):
+    # A 429 means the write was rejected, not applied, so it is safe to resend.
+    # Other errors are not retried: insertText is not idempotent.
+    for attempt in range(RATE_LIMIT_RETRIES):
+        try:
+            return fn(*args)
+        except HttpError as e:
+            if not is_rate_limited(e) or attempt == RATE_LIMIT_RETRIES - 1:
+                raise
+            time.sleep(2 ** attempt + random.random())
 
 
 def find_folder_id(drive, name: str) -> str:
     resp = drive.files().list(
         q=f"name = '{name}' and mimeType = 'application/vnd.google-apps.folder' and trashed = false",
-        fields="files(id, name)",
+        fields="files(id)",
         pageSize=10,
     ).execute()
     files = resp.get("files", [])
     return files[0]["id"] if files else ""
 
 
-def list_docs_in_folder(drive, folder_id: str):
-    docs = []
+def iter_docs_in_folder(drive, folder_id: str):
+    # Yields page by page, so a --limit run stops listing once it has enough docs.
     page_token = None
     while True:
         resp = drive.files().list(
@@ -72,19 +167,23 @@ def list_docs_in_folder(drive, folder_id: str):
                 f"'{folder_id}' in parents and "
                 "mimeType = 'application/vnd.google-apps.document' and trashed = false"
             ),
-            fields="nextPageToken, files(id, name)",
+            fields="nextPageToken, files(id)",
             pageSize=1000,
             pageToken=page_token,
         ).execute()
-        docs.extend(resp.get("files", []))
+        yield from resp.get("files", [])
         page_token = resp.get("nextPageToken")
         if not page_token:
             break
-    return docs
 
 
-def get_doc_text(docs_service, doc_id: str) -> str:
-    doc = docs_service.documents().get(documentId=doc_id).execute()
+# Docs batch requests accept up to 50 calls; only the text runs are fetched.
+DOCS_BATCH_SIZE = 50
+DOCS_RETRIES = 5
+DOC_TEXT_FIELDS = "body(content(paragraph(elements(textRun(content)))))"
+
+
+def doc_text(doc) -> str:
     parts = []
     for el in doc.get("body", {}).get("content", []):
         par = el.get("paragraph")
@@ -97,11 +196,59 @@ def get_doc_text(docs_service, doc_id: str) -> str:
     return "".join(parts)
 
 
+def is_retryable_read(e: Exception) -> bool:
+    return isinstance(e, HttpError) and (e.resp.status == 429 or e.resp.status >= 500)
+
+
+def get_docs_text(docs_service, doc_ids):
+    # Sub-requests of a batch are not retried by googleapiclient: throttled or
+    # 5xx reads are fetched again one at a time with the plain (retrying) call.
+    texts = {}
+    retry = []
+    errors = []
+
+    def get(doc_id):
+        return docs_service.documents().get(documentId=doc_id, fields=DOC_TEXT_FIELDS)
+
+    def on_doc(request_id, response, exception):
+        if exception is None:
+            texts[request_id] = doc_text(response)
+        elif is_retryable_read(exception):
+            retry.append(request_id)
+        else:
+            errors.append(exception)
+
+    for start in range(0, len(doc_ids), DOCS_BATCH_SIZE):
+        chunk = doc_ids[start : start + DOCS_BATCH_SIZE]
+        batch = docs_service.new_batch_http_request(callback=on_doc)
+        for doc_id in chunk:
+            batch.add(get(doc_id), request_id=doc_id)
+        try:
+            batch.execute()
+        except Exception:
+            retry.extend(chunk)
+        if errors:
+            raise errors[0]
+
+    for doc_id in dict.fromkeys(retry):
+        if doc_id not in texts:
+            texts[doc_id] = doc_text(get(doc_id).execute(num_retries=DOCS_RETRIES))
+    return texts
+
+
+DIGIT_RE = re.compile(r"\d")
+# Lowercased line prefixes that open the steps section.
+STEP_HEADERS = ("etape", "préparation", "preparation", "steps", "method")
+UNIT_RE = re.compile(
+    r"(kg|g|gr|mg|ml|cl|l|c\. ?a|c\. ?à|cuill|tbsp|tsp|cup|pinc[ée]e|sachet|tranche|gousse|piece|pi[eè]ce)",
+    re.IGNORECASE,
+)
+
+
 def extract_ingredients(text: str):
-    lines = [l.strip() for l in text.splitlines()]
     ingredients = []
     capture = False
-    for line in lines:
+    for line in text.splitlines():
         l = line.strip()
         if not l:
             if capture:
@@ -109,17 +256,15 @@ def extract_ingredients(text: str):
                 continue
             continue
         low = l.lower()
-        if "ingr" in low and "ingr" == low[:4]:
+        if low.startswith("ingr"):
             capture = True
             continue
         if capture:
             # stop when steps section starts
-            if low.startswith("etape") or low.startswith("préparation") or low.startswith("preparation"):
-                break
-            if low.startswith("steps") or low.startswith("method"):
+            if low.startswith(STEP_HEADERS):
                 break
             # accept list items
-            if l.startswith("-") or l.startswith("•") or re.match(r"^\d", l):
+            if l.startswith(("-", "•")) or DIGIT_RE.match(l):
                 ingredients.append(l.lstrip("-•").strip())
             else:
                 # heuristic: short line as ingredient
@@ -129,7 +274,7 @@ def extract_ingredients(text: str):
     seen = set()
     out = []
     for i in ingredients:
-        key = re.sub(r"\s+", " ", i.lower()).strip()
+        key = " ".join(i.lower().split())
         if key and key not in seen:
             out.append(i)
             seen.add(key)
@@ -141,39 +286,32 @@ def extract_ingredients_fallback(text: str):
     # find first steps header to bound ingredients block
     step_idx = None
     for i, line in enumerate(lines):
-        low = line.lower().strip()
-        if low.startswith("etape") or low.startswith("préparation") or low.startswith("preparation"):
-            step_idx = i
-            break
-        if low.startswith("steps") or low.startswith("method"):
+        low = line.lower()
+        if low.startswith(STEP_HEADERS):
             step_idx = i
             break
     if step_idx is None:
         return []
-    candidates = [l for l in lines[:step_idx] if l.strip()]
+    candidates = [l for l in lines[:step_idx] if l]
     if not candidates:
         return []
     # drop likely title line
     first = candidates[0]
     if (
-        not re.search(r"\d", first)
+        not DIGIT_RE.search(first)
         and not first.startswith(("-", "•"))
         and len(first) > 18
     ):
         candidates = candidates[1:]
-    unit_rx = re.compile(
-        r"(kg|g|gr|mg|ml|cl|l|c\. ?a|c\. ?à|cuill|tbsp|tsp|cup|pinc[ée]e|sachet|tranche|gousse|piece|pi[eè]ce)",
-        re.IGNORECASE,
-    )
     ingredients = []
     for l in candidates:
-        if l.startswith(("-", "•")) or re.match(r"^\d", l) or unit_rx.search(l):
+        if l.startswith(("-", "•")) or DIGIT_RE.match(l) or UNIT_RE.search(l):
             ingredients.append(l.lstrip("-•").strip())
     # de-dupe
     seen = set()
     out = []
     for i in ingredients:
-        key = re.sub(r"\s+", " ", i.lower()).strip()
+        key = " ".join(i.lower().split())
         if key and key not in seen:
             out.append(i)
             seen.add(key)
@@ -202,42 +340,66 @@ def main():
         help="Drive folder with docs to fix",
     )
     parser.add_argument("--limit", type=int, default=0, help="Max docs to process (0=all)")
+    parser.add_argument("--workers", type=int, default=WRITE_WORKERS, help="Concurrent doc writes")
     args = parser.parse_args()
 
-    drive = get_drive_client()
-    docs_service = build("docs", "v1", credentials=drive._http.credentials)
+    creds = get_drive_credentials()
+    # One authorized Http (and one token) shared by the Drive and Docs clients.
+    http = AuthorizedHttp(creds, http=build_http())
+    drive = build("drive", "v3", http=http, cache_discovery=False)
+    docs_service = build("docs", "v1", http=http, cache_discovery=False)
 
     folder_id = find_folder_id(drive, args.folder)
     if not folder_id:
         raise SystemExit(f"Folder not found: {args.folder}")
     recettes_folder_id = find_folder_id(drive, "Recettes")
 
-    docs = list_docs_in_folder(drive, folder_id)
-    fixed = 0
-    skipped = 0
-    if args.limit and args.limit > 0:
-        docs = docs[: args.limit]
+    limit = args.limit if args.limit and args.limit > 0 else None
+    docs = list(islice(iter_docs_in_folder(drive, folder_id), limit))
+
+    texts = get_docs_text(docs_service, [d["id"] for d in docs])
 
-    for d in docs:
-        text = get_doc_text(docs_service, d["id"])
+    def fix(d):
+        text = texts[d["id"]]
         ingredients = extract_ingredients(text)
         if not ingredients:
             ingredients = extract_ingredients_fallback(text)
         if not ingredients:
-            skipped += 1
-            continue
-        ok = insert_ingredients_section(docs_service, d["id"], ingredients)
-        if ok:
-            fixed += 1
-            if recettes_folder_id:
-                # move out of TO_FIX folder back to Recettes
-                drive.files().update(
-                    fileId=d["id"],
-                    addParents=recettes_folder_id,
-                    removeParents=folder_id,
-                    fields="id,parents",
-                ).execute()
-    print({"fixed": fixed, "skipped": skipped, "total": len(docs)})
+            return False
+        return write_with_backoff(insert_ingredients_section, thread_docs_service(creds), d["id"], ingredients)
+
+    # Inserts are not idempotent: every doc that got its section must leave TO_FIX,
+    # even when other writes fail, or the next run would insert it again.
+    fixed_ids = []
+    throttled = []
+    errors = []
+    unmoved = []
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, args.workers)) as pool:
+            futures = {pool.submit(fix, d): d for d in docs}
+            for fut in as_completed(futures):
+                try:
+                    ok = fut.result()
+                except Exception as e:
+                    # Throttled docs were left untouched and stay in TO_FIX for a later run.
+                    (throttled if is_rate_limited(e) else errors).append((futures[fut], e))
+                    continue
+                if ok:
+                    fixed_ids.append(futures[fut]["id"])
+    finally:
+        if recettes_folder_id and fixed_ids:
+            # move fixed docs out of TO_FIX folder back to Recettes
+            unmoved = move_docs(drive, fixed_ids, recettes_folder_id, folder_id)
+    fixed = len(fixed_ids)
+    skipped = len(docs) - fixed - len(throttled) - len(errors)
+    print({"fixed": fixed, "skipped": skipped, "throttled": len(throttled), "failed": len(errors), "total": len(docs)})
+    if unmoved:
+        # Already fixed: a rerun would insert their section a second time.
+        doc_id, e = unmoved[0]
+        raise SystemExit(f"{len(unmoved)} fixed doc(s) left in {args.folder}, move them by hand; first {doc_id}: {e}")
+    if errors:
+        d, e = errors[0]
+        raise SystemExit(f"{len(errors)} doc(s) could not be fixed, first {d['id']}: {e}")
 
 
 if __name__ == "__main__":
@@ -4,7 +4,10 @@ from pathlib import Path
 
 from google.oauth2.credentials import Credentials
 from google.auth.transport.requests import Request
+from google_auth_httplib2 import AuthorizedHttp
 from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
+from googleapiclient.http import build_http
 
 
 def resolve_token():
@@ -17,7 +20,7 @@ def resolve_token():
 def find_folder(drive, name):
     resp = drive.files().list(
         q=f"name = '{name}' and mimeType = 'application/vnd.google-apps.folder' and trashed = false",
-        fields="files(id,name)",
+        fields="files(id)",
         pageSize=10,
     ).execute()
     files = resp.get("files", [])
@@ -41,8 +44,13 @@ def list_docs(drive, folder_id):
     return docs
 
 
-def get_text(docs_api, doc_id):
-    doc = docs_api.documents().get(documentId=doc_id).execute()
+# Docs batch requests accept up to 50 calls; only the text runs are fetched.
+DOCS_BATCH_SIZE = 50
+DOCS_RETRIES = 5
+DOC_TEXT_FIELDS = "body(content(paragraph(elements(textRun(content)))))"
+
+
+def doc_text(doc):
     parts = []
     for el in doc.get("body", {}).get("content", []):
         par = el.get("paragraph")
@@ -55,6 +63,46 @@ def get_text(docs_api, doc_id):
     return "".join(parts)
 
 
+def is_retryable_read(e: Exception) -> bool:
+    return isinstance(e, HttpError) and (e.resp.status == 429 or e.resp.status >= 500)
+
+
+def get_docs_text(docs_api, doc_ids):
+    # Sub-requests of a batch are not retried by googleapiclient: throttled or
+    # 5xx reads are fetched again one at a time with the plain (retrying) call.
+    texts = {}
+    retry = []
+    errors = []
+
+    def get(doc_id):
+        return docs_api.documents().get(documentId=doc_id, fields=DOC_TEXT_FIELDS)
+
+    def on_doc(request_id, response, exception):
+        if exception is None:
+            texts[request_id] = doc_text(response)
+        elif is_retryable_read(exception):
+            retry.append(request_id)
+        else:
+            errors.append(exception)
+
+    for start in range(0, len(doc_ids), DOCS_BATCH_SIZE):
+        chunk = doc_ids[start : start + DOCS_BATCH_SIZE]
+        batch = docs_api.new_batch_http_request(callback=on_doc)
+        for doc_id in chunk:
+            batch.add(get(doc_id), request_id=doc_id)
+        try:
+            batch.execute()
+        except Exception:
+            retry.extend(chunk)
+        if errors:
+            raise errors[0]
+
+    for doc_id in dict.fromkeys(retry):
+        if doc_id not in texts:
+            texts[doc_id] = doc_text(get(doc_id).execute(num_retries=DOCS_RETRIES))
+    return texts
+
+
 def extract_any(text):
     t = text.lower()
     return ("ingr" in t) or ("etape" in t) or ("préparation" in t) or ("preparation" in t)
@@ -66,16 +114,19 @@ def main():
     creds = Credentials.from_authorized_user_file(token_path, scopes=scopes)
     if creds.expired and creds.refresh_token:
         creds.refresh(Request())
-    drive = build("drive", "v3", credentials=creds)
-    docs_api = build("docs", "v1", credentials=creds)
+    # One authorized Http (and one token) shared by the Drive and Docs clients.
+    http = AuthorizedHttp(creds, http=build_http())
+    drive = build("drive", "v3", http=http, cache_discovery=False)
+    docs_api = build("docs", "v1", http=http, cache_discovery=False)
 
     folder_id = find_folder(drive, "TO_FIX_missing_both")
     if not folder_id:
         raise SystemExit("Folder TO_FIX_missing_both not found")
 
     docs = list_docs(drive, folder_id)
+    texts = get_docs_text(docs_api, [d["id"] for d in docs])
     for d in docs:
-        text = get_text(docs_api, d["id"])
+        text = texts[d["id"]]
         if not extract_any(text):
             print("SKIPPED:", d["name"], d.get("webViewLink", ""))
 
@@ -2,7 +2,7 @@
 import argparse
 import json
 import os
-import re
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
 
 from google.oauth2.credentials import Credentials
@@ -10,6 +10,11 @@ from google.auth.transport.requests import Request
 from googleapiclient.discovery import build
 from google_auth_oauthlib.flow import InstalledAppFlow
 
+try:
+    import orjson  # optional: much faster parse of large indexes
+except ImportError:
+    orjson = None
+
 
 def resolve_oauth_token_file() -> str:
     secrets_dir = os.environ.get("MEAL_PLANNER_SECRETS_DIR", "").strip()
@@ -33,12 +38,26 @@ def resolve_oauth_client_file() -> str:
     return ""
 
 
+# Refresh tokens about to expire before the run, not mid-request.
+TOKEN_REFRESH_MARGIN = timedelta(minutes=5)
+
+
+def token_expires_soon(creds) -> bool:
+    if not creds.expiry:
+        return False
+    # google-auth keeps expiry as naive UTC
+    return creds.expiry - datetime.now(timezone.utc).replace(tzinfo=None) < TOKEN_REFRESH_MARGIN
+
+
 def get_drive_client():
     token_path = resolve_oauth_token_file()
     scopes = ["https://www.googleapis.com/auth/drive.file"]
     creds = None
     if os.path.exists(token_path):
         creds = Credentials.from_authorized_user_file(token_path, scopes=scopes)
+    if creds and creds.valid and creds.refresh_token and token_expires_soon(creds):
+        creds.refresh(Request())
+        Path(token_path).write_text(creds.to_json(), encoding="utf-8")
     if not creds or not creds.valid:
         if creds and creds.expired and creds.refresh_token:
             creds.refresh(Request())
@@ -50,46 +69,60 @@ def get_drive_client():
             oauth_port = int(os.environ.get("DRIVE_OAUTH_PORT", "3002"))
             creds = flow.run_local_server(port=oauth_port, prompt="consent")
         Path(token_path).write_text(creds.to_json(), encoding="utf-8")
-    return build("drive", "v3", credentials=creds)
+    return build("drive", "v3", credentials=creds, cache_discovery=False)
 
 
 def normalize_name(name: str) -> str:
-    base = re.sub(r"\.pdf$", "", name.strip(), flags=re.IGNORECASE)
-    base = re.sub(r"\s+", " ", base).strip()
-    return base
+    base = name.strip()
+    if base[-4:].lower() == ".pdf":
+        base = base[:-4]
+    return " ".join(base.split())
 
 
 def find_folder_id(drive, name: str) -> str:
     resp = drive.files().list(
         q=f"name = '{name}' and mimeType = 'application/vnd.google-apps.folder' and trashed = false",
-        fields="files(id, name)",
+        fields="files(id)",
         pageSize=10,
     ).execute()
     files = resp.get("files", [])
     return files[0]["id"] if files else ""
 
 
-def ensure_subfolder(drive, parent_id: str, name: str) -> str:
-    resp = drive.files().list(
-        q=(
-            f"'{parent_id}' in parents and name = '{name}' "
-            "and mimeType = 'application/vnd.google-apps.folder' and trashed = false"
-        ),
-        fields="files(id, name)",
-        pageSize=10,
-    ).execute()
-    files = resp.get("files", [])
-    if files:
-        return files[0]["id"]
-    created = drive.files().create(
-        body={
-            "name": name,
-            "mimeType": "application/vnd.google-apps.folder",
-            "parents": [parent_id],
-        },
-        fields="id",
-    ).execute()
-    return created["id"]
+def ensure_subfolders(drive, parent_id: str, names) -> dict:
+    # One listing of the parent's subfolders; only the missing ones are created.
+    existing = {}
+    page_token = None
+    while True:
+        resp = drive.files().list(
+            q=(
+                f"'{parent_id}' in parents "
+                "and mimeType = 'application/vnd.google-apps.folder' and trashed = false"
+            ),
+            fields="nextPageToken, files(id, name)",
+            pageSize=1000,
+            pageToken=page_token,
+        ).execute()
+        for f in resp.get("files", []):
+            existing.setdefault(f["name"], f["id"])
+        page_token = resp.get("nextPageToken")
+        if not page_token:
+            break
+
+    ids = {}
+    for name in names:
+        if name not in existing:
+            created = drive.files().create(
+                body={
+                    "name": name,
+                    "mimeType": "application/vnd.google-apps.folder",
+                    "parents": [parent_id],
+                },
+                fields="id",
+            ).execute()
+            existing[name] = created["id"]
+        ids[name] = existing[name]
+    return ids
 
 
 def list_docs_in_folder(drive, folder_id: str):
@@ -101,7 +134,7 @@ def list_docs_in_folder(drive, folder_id: str):
                 f"'{folder_id}' in parents and "
                 "mimeType = 'application/vnd.google-apps.document' and trashed = false"
             ),
-            fields="nextPageToken, files(id, name, webViewLink, parents)",
+            fields="nextPageToken, files(id, name)",
             pageSize=1000,
             pageToken=page_token,
         ).execute()
@@ -113,12 +146,40 @@ def list_docs_in_folder(drive, folder_id: str):
     return docs
 
 
-def add_parent(drive, file_id: str, parent_id: str):
-    drive.files().update(
-        fileId=file_id,
-        addParents=parent_id,
-        fields="id, parents",
-    ).execute()
+# Drive batch requests accept up to 100 calls.
+DRIVE_BATCH_SIZE = 100
+DRIVE_RETRIES = 5
+
+
+def add_parents(drive, moves):
+    # moves: (file_id, parent_id) pairs, sent DRIVE_BATCH_SIZE per HTTP request.
+    # Failed sub-requests (not retried by googleapiclient) are sent again one at
+    # a time; returns (file_id, error) for the ones that still failed.
+    failed = []
+
+    def update(file_id, parent_id):
+        return drive.files().update(fileId=file_id, addParents=parent_id, fields="id")
+
+    def on_update(request_id, response, exception):
+        if exception is not None:
+            failed.append(moves[int(request_id)])
+
+    for start in range(0, len(moves), DRIVE_BATCH_SIZE):
+        batch = drive.new_batch_http_request(callback=on_update)
+        for i in range(start, min(start + DRIVE_BATCH_SIZE, len(moves))):
+            batch.add(update(*moves[i]), request_id=str(i))
+        try:
+            batch.execute()
+        except Exception:
+            failed.extend(moves[start : start + DRIVE_BATCH_SIZE])
+
+    errors = []
+    for file_id, parent_id in dict.fromkeys(failed):
+        try:
+            update(file_id, parent_id).execute(num_retries=DRIVE_RETRIES)
+        except Exception as e:
+            errors.append((file_id, e))
+    return errors
 
 
 def main():
@@ -139,7 +200,10 @@ def main():
     if not index_path.exists():
         raise SystemExit(f"Index not found: {index_path}")
 
-    idx = json.loads(index_path.read_text())
+    if orjson is not None:
+        idx = orjson.loads(index_path.read_bytes())
+    else:
+        idx = json.loads(index_path.read_text())
 
     drive = get_drive_client()
     folder_id = find_folder_id(drive, args.folder)
@@ -171,26 +235,24 @@ def main():
         else:
             to_fix["missing_steps"].append(doc)
 
-    sub_ids = {
-        "missing_ingredients": ensure_subfolder(drive, folder_id, "TO_FIX_missing_ingredients"),
-        "missing_steps": ensure_subfolder(drive, folder_id, "TO_FIX_missing_steps"),
-        "missing_both": ensure_subfolder(drive, folder_id, "TO_FIX_missing_both"),
-    }
+    folders = ensure_subfolders(drive, folder_id, [f"TO_FIX_{key}" for key in to_fix])
+    sub_ids = {key: folders[f"TO_FIX_{key}"] for key in to_fix}
 
-    for key, docs_list in to_fix.items():
-        for doc in docs_list:
-            add_parent(drive, doc["id"], sub_ids[key])
+    errors = add_parents(drive, [(doc["id"], sub_ids[key]) for key, docs_list in to_fix.items() for doc in docs_list])
 
     print(
         json.dumps(
             {
-                "ok": True,
+                "ok": not errors,
                 "missing_ingredients": len(to_fix["missing_ingredients"]),
                 "missing_steps": len(to_fix["missing_steps"]),
                 "missing_both": len(to_fix["missing_both"]),
             }
         )
     )
+    if errors:
+        file_id, e = errors[0]
+        raise SystemExit(f"{len(errors)} doc(s) could not be tagged, first {file_id}: {e}")
 
 
 if __name__ == "__main__":
@@ -18,6 +18,11 @@ import sys
 from pathlib import Path
 from collections import defaultdict
 
+try:
+    import orjson  # optional: much faster parse of large indexes
+except ImportError:
+    orjson = None
+
 
 BASE_DIR = Path(__file__).resolve().parent.parent
 INDEX_PATH = BASE_DIR / "recettes_index.json"
@@ -27,6 +32,8 @@ def load_index():
     if not INDEX_PATH.exists():
         print(f"ERROR: {INDEX_PATH} not found. Run recettes_rescan.py first.")
         sys.exit(2)
+    if orjson is not None:
+        return orjson.loads(INDEX_PATH.read_bytes())
     with INDEX_PATH.open("r", encoding="utf-8") as f:
         return json.load(f)
 
@@ -40,25 +47,21 @@ def main():
     by_norm = defaultdict(list)
     by_key = defaultdict(list)
 
+    # Bucket the raw index items; only duplicates are ever printed.
     for item in data:
-        title = item.get("title", "")
         norm = item.get("normalized_title", "")
         key = item.get("title_key", "")
-        fid = item.get("file_id", "")
-        path = item.get("fullPath", "")
-
-        entry = {"title": title, "file_id": fid, "fullPath": path, "normalized_title": norm, "title_key": key}
         if norm:
-            by_norm[norm].append(entry)
+            by_norm[norm].append(item)
         if key:
-            by_key[key].append(entry)
+            by_key[key].append(item)
 
     exact_dups = {k: v for k, v in by_norm.items() if len(v) > 1}
     near_dups = {}
     for k, v in by_key.items():
         if len(v) <= 1:
             continue
-        norms = {e["normalized_title"] for e in v}
+        norms = {e.get("normalized_title", "") for e in v}
         if len(norms) > 1:
             near_dups[k] = v
 
@@ -67,14 +70,14 @@ def main():
         for k, v in exact_dups.items():
             print(f"- {k}")
             for e in v:
-                print(f"  * {e['title']}  [{e['file_id']}]  {e['fullPath']}")
+                print(f"  * {e.get('title', '')}  [{e.get('file_id', '')}]  {e.get('fullPath', '')}")
 
     if near_dups:
         print("\n=== Near duplicates (title_key) ===")
         for k, v in near_dups.items():
             print(f"- {k}")
             for e in v:
-                print(f"  * {e['title']}  [{e['file_id']}]  {e['fullPath']}")
+                print(f"  * {e.get('title', '')}  [{e.get('file_id', '')}]  {e.get('fullPath', '')}")
 
     if exact_dups or near_dups:
         sys.exit(1)